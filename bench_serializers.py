@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""bench_serializers.py
+
+Micro-benchmark of the compiled form copiers in serializers.py against
+the reflective copy loop they replaced. Needs the App Engine SDK on the
+path, e.g.:
+
+    PYTHONPATH=$SDK:$SDK/lib/protorpc-1.0 python bench_serializers.py [N]
+
+"""
+
+import os
+import sys
+import timeit
+from datetime import date
+
+os.environ.setdefault('APPLICATION_ID', 'dev~bench')
+
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ConferenceForm
+from models import Session
+from models import SessionForm
+from models import SessionType
+from serializers import copyToForms
+
+
+def reflectiveConference(conf):
+    """The former ConferenceApi._copyConferenceToForm loop."""
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, conf.key.urlsafe())
+    cf.check_initialized()
+    return cf
+
+
+def reflectiveSession(sess):
+    """The former ConferenceApi._copySessionToForm loop (with duration
+    copied instead of overwriting endTime)."""
+    sf = SessionForm()
+    for field in sf.all_fields():
+        if hasattr(sess, field.name):
+            if field.name in ('date', 'startTime', 'endTime', 'duration'):
+                setattr(sf, field.name, str(getattr(sess, field.name)))
+            elif field.name == 'typeOfSession':
+                try:
+                    setattr(sf, field.name, getattr(SessionType, getattr(sess, field.name)))
+                except AttributeError:
+                    setattr(sf, field.name, getattr(SessionType, 'NOT_SPECIFIED'))
+            else:
+                setattr(sf, field.name, getattr(sess, field.name))
+    sf.websafeKey = sess.key.urlsafe()
+    sf.check_initialized()
+    return sf
+
+
+def makeEntities(n):
+    """Return n in-memory Conferences and n Sessions; nothing is stored."""
+    confs, sessions = [], []
+    for i in range(n):
+        c_key = ndb.Key('Profile', 'user%d' % (i % 50), Conference, i + 1)
+        confs.append(Conference(
+            key=c_key, name='Conference %d' % i, description='x' * 200,
+            organizerUserId='user%d' % (i % 50), topics=['Web', 'Python'],
+            city='London', startDate=date(2015, 6, 1), month=6,
+            endDate=date(2015, 6, 3), maxAttendees=100, seatsAvailable=40))
+        sessions.append(Session(
+            key=ndb.Key(Session, i + 1, parent=c_key), name='Session %d' % i,
+            highlights='y' * 100, speaker='Speaker %d' % (i % 20),
+            duration=60, typeOfSession='LECTURE', date=date(2015, 6, 1),
+            startTime=900 + i % 800, endTime=1000 + i % 800,
+            venue='Main Hall', topics=['Web']))
+    return confs, sessions
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    repeat = 5
+    confs, sessions = makeEntities(n)
+
+    cases = [
+        ('Conference reflective', lambda: [reflectiveConference(c) for c in confs]),
+        ('Conference compiled', lambda: copyToForms(Conference, ConferenceForm, confs)),
+        ('Session reflective', lambda: [reflectiveSession(s) for s in sessions]),
+        ('Session compiled', lambda: copyToForms(Session, SessionForm, sessions)),
+    ]
+    for name, run in cases:
+        best = min(timeit.repeat(run, number=1, repeat=repeat))
+        print('%-22s %8.2f ms for %d  (%.1f us/entity)' % (
+            name, best * 1000, n, best * 1e6 / n))
+
+    # both paths must produce the same forms
+    assert [reflectiveConference(c) for c in confs] == \
+        copyToForms(Conference, ConferenceForm, confs)
+    assert [reflectiveSession(s) for s in sessions] == \
+        copyToForms(Session, SessionForm, sessions)
+
+
+if __name__ == '__main__':
+    main()
@@ -16,42 +16,79 @@ __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 from datetime import datetime, time, date
 
+import bisect
 import endpoints
+import hashlib
+import json
 import logging
+import random
 
 from protorpc import messages
 from protorpc import message_types
 from protorpc import remote
 
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
+from google.appengine.datastore import entity_pb
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 
+from models import AttendeeForms
+from models import AttendeeForm
 from models import ConflictException
 from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
+from models import QueryPlanForm
+from models import Registration
 from models import StringMessage
 from models import BooleanMessage
+from models import FacetValueForm
 from models import Conference
 from models import ConferenceForm
+from models import ConferenceFacets
+from models import ConferenceFacetsForm
 from models import ConferenceForms
 from models import ConferenceQueryForms
+from models import SeatShard
+from models import NearlySoldOut
+from models import Admission
+from models import RegistrationStatus
+from models import RegistrationStatusForm
 from models import TeeShirtSize
 
 from models import Session
 from models import SessionForm
 from models import SessionForms
+from models import SessionBulkForm
+from models import SessionResultForm
+from models import SessionResultForms
+from models import SessionConflictForm
+from models import SessionConflictForms
+from models import ScheduleRequestForm
+from models import ScheduleWeight
 from models import SessionType
 from models import StringMessage_Featured
 from models import SessionQueryForms
+from models import SpeakerTally
+from models import WishlistForm
+from models import WishlistSchedule
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
 from settings import IOS_CLIENT_ID
 from settings import ANDROID_AUDIENCE
-
+from settings import NEARLY_SOLD_OUT_SEATS
+
+import planner
+import recommend
+import schedule
+import search
+from serializers import copyToForms
+from serializers import formCopier
+from stats import instrumented
 from utils import getUserId
 
 
@@ -60,6 +97,35 @@ API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
 ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
                     'are nearly sold out: %s')
+MEMCACHE_NEARLY_SOLD_OUT_KEY = "NEARLY_SOLD_OUT"
+MEMCACHE_SEATS_KEY = "SEATS_AVAILABLE:%s"
+MEMCACHE_FACETS_KEY = "CONFERENCE_FACETS"
+FACET_CAS_RETRIES = 5
+FACET_SHARDS = 10
+NEARLY_SOLD_OUT_CAS_RETRIES = 5
+SEATS_CACHE_TTL = 60
+SEAT_SHARDS = 10
+MEMCACHE_SCHEDULE_KEY = "SCHEDULE:%s:%d"
+MEMCACHE_SCHEDULE_VERSION_KEY = "SCHEDULE_VERSION:%s"
+MEMCACHE_CONFERENCE_VERSION_KEY = "CONFERENCE_VERSION:%s"
+MEMCACHE_TIME_INDEX_KEY = "SESSION_TIME_INDEX:%s:%d"
+MEMCACHE_FEATURED_KEY = "FEATURED_SPEAKERS:%s"
+FEATURED_SPEAKERS = 5
+ADMISSION_QUEUE = "admissions"
+ADMISSION_BATCH_SIZE = 12     # Profiles per transaction, within the xg limit
+ADMISSION_BATCH_DELAY = 2     # seconds of requests coalesced per worker run
+ADMISSION_LEASE_SECONDS = 60
+MEMCACHE_ADMISSION_PENDING_KEY = "ADMISSION_PENDING:%s:%s"
+ADMISSION_TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+MAX_BULK_SESSIONS = 100
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# share of sessions an equality filter on the field lets through
+SESSION_SELECTIVITY = {'speaker': 0.02, 'venue': 0.05, 'date': 0.2,
+                       'typeOfSession': 0.2, 'topics': 0.1}
+# share of conferences an equality filter on the field lets through
+CONFERENCE_SELECTIVITY = {'city': 0.05, 'topics': 0.2, 'month': 1 / 12.0,
+                          'maxAttendees': 0.05}
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -70,6 +136,15 @@ DEFAULTS = {
     "topics": [ "Default", "Topic" ],
 }
 
+# weight of a session per typeOfSession when building a schedule
+SCHEDULE_TYPE_WEIGHTS = {
+    'KEYNOTE': 4,
+    'WORKSHOP': 3,
+    'LECTURE': 2,
+    'PRESENTATION': 2,
+    'NOT_SPECIFIED': 1,
+}
+
 SESSION_DEFAULTS = {
     "highlights": "Not provided",
     "speaker": "Unknown",
@@ -93,20 +168,49 @@ FIELDS =    {
             'MAX_ATTENDEES': 'maxAttendees',
             }
 
+SESSION_FIELDS = {
+            'SPEAKER': 'speaker',
+            'TYPE': 'typeOfSession',
+            'DATE': 'date',
+            'START_TIME': 'startTime',
+            'DURATION': 'duration',
+            'VENUE': 'venue',
+            'TOPIC': 'topics',
+            }
+
 
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_GET_VERSIONED_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2),
+)
+
+CONF_ATTENDING_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    ifNoneMatch=messages.StringField(1),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_ROSTER_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+)
+
 SESS_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2),
 )
 
 SESS_GET_TYPE = endpoints.ResourceContainer(
@@ -126,6 +230,19 @@ SESS_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+SESS_BULK_POST_REQUEST = endpoints.ResourceContainer(
+    SessionBulkForm,
+    websafeConferenceKey=messages.StringField(1),
+)
+
+SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1),
+    websafeConferenceKey=messages.StringField(2),
+    pageSize=messages.IntegerField(3),
+    pageToken=messages.StringField(4),
+)
+
 SESS_TO_WISHLIST_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     sessionKey=messages.StringField(1),
@@ -135,6 +252,17 @@ SESS_IN_WISHLIST_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+SESS_RECOMMEND_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+)
+
+SESS_SCHEDULE_REQUEST = endpoints.ResourceContainer(
+    ScheduleRequestForm,
+    websafeConferenceKey=messages.StringField(1),
+)
+
 SESS_GET_DATE = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
@@ -162,24 +290,56 @@ class ConferenceApi(remote.Service):
     """Conference API v0.1"""
 
 # - - - Conference objects - - - - - - - - - - - - - - - - -
-    def _copyConferenceToForm(self, conf, displayName):
-        """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
+    def _copyConferenceToForm(self, conf, displayName, seatsAvailable=None,
+                              fields=None):
+        """Copy relevant fields from Conference to ConferenceForm, only
+        those in the fields mask if one is given."""
+        # dates are converted to strings by the compiled copier
+        cf = formCopier(Conference, ConferenceForm, fields)(conf)
         if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
+            cf.organizerDisplayName = displayName
+        if seatsAvailable is not None:
+            cf.seatsAvailable = seatsAvailable
         return cf
 
 
+    def _conferenceFormsAsync(self, confs, prof_futs=None, fields=None):
+        """Return a Future for the ConferenceForms of confs.
+
+        confs may hold Conference entities or Futures for them; each
+        organiser Profile is requested as soon as its conference arrives
+        and at most once per organiser. Missing conferences are dropped.
+        prof_futs optionally seeds organiser ID -> Profile Future. With a
+        fields mask, organisers and seats are only looked up if asked for.
+        """
+        prof_futs = {} if prof_futs is None else prof_futs
+        want = lambda name: fields is None or name in fields
+
+        @ndb.tasklet
+        def toForm(conf):
+            if isinstance(conf, ndb.Future):
+                conf = yield conf
+            if not conf:
+                raise ndb.Return(None)
+            # the organiser is the parent, also of projected conferences
+            uid = conf.key.parent().id()
+            if want('organizerDisplayName') and uid not in prof_futs:
+                prof_futs[uid] = ndb.Key(Profile, uid).get_async()
+            prof_fut = prof_futs.get(uid) if want('organizerDisplayName') else None
+            seats_fut = self._seatsAvailableAsync(conf) if want('seatsAvailable') else None
+            prof = (yield prof_fut) if prof_fut else None
+            seats = (yield seats_fut) if seats_fut else None
+            raise ndb.Return(self._copyConferenceToForm(
+                conf, getattr(prof, 'displayName', None), seats, fields))
+
+        @ndb.tasklet
+        def allForms():
+            forms = yield [toForm(conf) for conf in confs]
+            raise ndb.Return([cf for cf in forms if cf])
+
+        return allForms()
+
+
     def _createConferenceObject(self, request):
         """Create or update Conference object, returning ConferenceForm/request."""
         # preload necessary data items
@@ -224,9 +384,12 @@ class ConferenceApi(remote.Service):
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
 
-        # create Conference, send email to organizer confirming
-        # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
+        # create Conference and its seat shards, send email to organizer
+        # confirming creation of Conference & return (modified) ConferenceForm
+        conf = Conference(**data)
+        ndb.put_multi([conf, search.documentFor(conf)])
+        self._putSeatShards(conf)
+        self._trackFacets([(self._facetBuckets(conf), 1, conf.seatsAvailable or 0)])
         taskqueue.add(params={'email': user.email(),
             'conferenceInfo': repr(request)},
             url='/tasks/send_confirmation_email'
@@ -234,8 +397,11 @@ class ConferenceApi(remote.Service):
         return request
 
 
-    @ndb.transactional()
+    @ndb.transactional(xg=True)
     def _updateConferenceObject(self, request):
+        """Write the changed fields of a Conference (and its seat shards if
+        seatsAvailable is sent). Returns (conf, seats left, facet changes);
+        caches are updated by the caller once the transaction committed."""
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
@@ -255,6 +421,8 @@ class ConferenceApi(remote.Service):
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
+        old_buckets = self._facetBuckets(conf)
+        old_seats = self._seatsAvailableAsync(conf).get_result()
 
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
@@ -269,13 +437,21 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
-        conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        ndb.put_multi([conf, search.documentFor(conf)])
+
+        # a new seatsAvailable replaces whatever the shards hold
+        if request.seatsAvailable is not None:
+            self._putSeatShards(conf)
+            seats = conf.seatsAvailable
+        else:
+            seats = self._seatsAvailableAsync(conf).get_result()
+        return conf, seats, [(old_buckets, -1, -old_seats),
+                             (self._facetBuckets(conf), 1, seats)]
 
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
+    @instrumented
     def createConference(self, request):
         """Create new conference."""
         return self._createConferenceObject(request)
@@ -284,29 +460,59 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='PUT', name='updateConference')
+    @instrumented
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
-        return self._updateConferenceObject(request)
-
-
-    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
+        conf, seats, facet_changes = self._updateConferenceObject(request)
+
+        # memcache is only touched after the commit, once; a retried
+        # transaction must not apply the facet changes twice, and readers
+        # must not see the new etag with the old conference
+        if request.seatsAvailable is not None:
+            memcache.delete(MEMCACHE_SEATS_KEY % conf.key.urlsafe())
+        self._trackFacets(facet_changes)
+        if request.seatsAvailable is not None and seats > 0:
+            # added seats go to the waitlist first
+            seats -= self._drainWaitlist(conf)
+        self._conferenceVersion(conf.key, bump=True)
+        if request.topics:
+            # conference topics are features of its sessions' recommendations
+            self._scheduleVersion(conf.key, bump=True)
+        self._trackNearlySoldOut(conf.key, conf.name, seats)
+
+        prof = ndb.Key(Profile, conf.organizerUserId).get()
+        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'), seats)
+
+
+    @endpoints.method(CONF_GET_VERSIONED_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='GET', name='getConference')
+    @instrumented
     def getConference(self, request):
-        """Return requested conference (by websafeConferenceKey)."""
+        """Return requested conference (by websafeConferenceKey); only
+        notModified if ifNoneMatch is its current etag."""
+        conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        etag = str(self._conferenceVersion(conf_key))
+        if request.ifNoneMatch == etag:
+            return ConferenceForm(etag=etag, notModified=True)
+
         # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = conf_key.get()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
+        prof, seats = conf.key.parent().get_async(), self._seatsAvailableAsync(conf)
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        cf = self._copyConferenceToForm(
+            conf, getattr(prof.get_result(), 'displayName'), seats.get_result())
+        cf.etag = etag
+        return cf
 
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                       path='getConferencesCreated',
                       http_method='POST', name='getConferencesCreated')
+    @instrumented
     def getConferencesCreated(self, request):
         """Return conferences created by user."""
         # make sure user is authed
@@ -315,127 +521,197 @@ class ConferenceApi(remote.Service):
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = getUserId(user)
 
-        # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        # run the ancestor query for this user's conferences and the
+        # Profile lookup in parallel; the user is the organiser of all
+        p_key = ndb.Key(Profile, user_id)
+        confs = Conference.query(ancestor=p_key).fetch_async()
+        prof_futs = {user_id: p_key.get_async()}
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs])
+        return ConferenceForms(items=self._conferenceFormsAsync(
+            confs.get_result(), prof_futs).get_result())
 
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
+    def _getQuery(self, request, fields=None):
+        """Return the QueryPlan of the submitted filters: the filters an
+        index in index.yaml serves run in the datastore, the rest in memory.
+        With a fields mask it is a projection query if an index allows."""
+        return planner.plan(Conference, self._formatFilters(request.filters),
+                            ['name'], selectivity=CONFERENCE_SELECTIVITY,
+                            projection=self._maskProperties(Conference, fields))
 
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
 
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-        return q
+    @staticmethod
+    def _fieldMask(form, fields):
+        """Check a field mask against a form; return it as a set, or None
+        if there is no mask."""
+        if not fields:
+            return None
+        unknown = set(fields) - set(field.name for field in form.all_fields())
+        if unknown:
+            raise endpoints.BadRequestException(
+                "Unknown fields: %s" % ', '.join(sorted(unknown)))
+        return set(fields)
 
 
-    def _formatFilters(self, filters):
-        """Parse, check validity and format user supplied filters."""
+    @staticmethod
+    def _maskProperties(model, fields):
+        """Return the model properties a fields mask needs, or None."""
+        props = [name for name in fields or () if name in model._properties]
+        return props or None
+
+
+    def _formatFilters(self, filters, fields=FIELDS, model=Conference):
+        """Parse, check validity and format user supplied filters, with
+        values converted to the type of the model property."""
+        if len(filters) > planner.MAX_FILTERS:
+            raise endpoints.BadRequestException(
+                "At most %d filters are allowed." % planner.MAX_FILTERS)
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
 
             try:
-                filtr["field"] = FIELDS[filtr["field"]]
+                filtr["field"] = fields[filtr["field"]]
                 filtr["operator"] = OPERATORS[filtr["operator"]]
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+            prop = model._properties[filtr["field"]]
+            try:
+                if isinstance(prop, ndb.IntegerProperty):
+                    filtr["value"] = int(filtr["value"])
+                elif isinstance(prop, ndb.DateProperty):
+                    filtr["value"] = datetime.strptime(
+                        filtr["value"][:10], "%Y-%m-%d").date()
+                elif filtr["field"] == "typeOfSession":
+                    filtr["value"] = SessionType(filtr["value"].upper()).name
+            except (AttributeError, TypeError, ValueError):
+                raise endpoints.BadRequestException(
+                    "Invalid value for filter on %s." % filtr["field"])
 
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return formatted_filters
+
+
+    def _pageSize(self, request):
+        """Return the checked pageSize of a paged request."""
+        page_size = request.pageSize or DEFAULT_PAGE_SIZE
+        if page_size < 1 or page_size > MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                "pageSize must be between 1 and %d." % MAX_PAGE_SIZE)
+        return page_size
+
+
+    def _pageParams(self, request):
+        """Return (pageSize, start Cursor) of a paged request."""
+        page_size = self._pageSize(request)
+
+        cursor = None
+        if request.pageToken:
+            try:
+                cursor = Cursor(urlsafe=request.pageToken)
+            except datastore_errors.BadValueError:
+                raise endpoints.BadRequestException("Invalid pageToken.")
+        return page_size, cursor
+
+
+    def _fetchPage(self, q, request):
+        """Fetch one page of query results using pageSize/pageToken.
+
+        Returns (entities, nextPageToken); the token is None on the last page.
+        """
+        page_size, cursor = self._pageParams(request)
+        items, next_cursor, more = q.fetch_page(page_size, start_cursor=cursor)
+        next_token = next_cursor.urlsafe() if more and next_cursor else None
+        return items, next_token
 
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
                       path='queryConferences',
                       http_method='POST', name='queryConferences')
+    @instrumented
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
+        """Query for conferences, one page at a time. With explain set
+        only the query plan and its estimated cost are returned."""
+        page_size, cursor = self._pageParams(request)
+        fields = self._fieldMask(ConferenceForm, request.fields)
+        plan = self._getQuery(request, fields)
+        if request.explain:
+            return ConferenceForms(plan=self._copyPlanToForm(plan, page_size))
 
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        conferences, next_cursor = plan.fetchPage(page_size, cursor)
 
+        # organiser displayNames are fetched concurrently, once per organiser
         # return individual ConferenceForm object per Conference
         return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
-                conferences]
+                items=self._conferenceFormsAsync(
+                    conferences, fields=fields).get_result(),
+                nextPageToken=next_cursor.urlsafe() if next_cursor else None
         )
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @staticmethod
+    def _copyPlanToForm(plan, page_size):
+        """Copy a QueryPlan to QueryPlanForm."""
+        return QueryPlanForm(
+            index=plan.describe(),
+            pushedFilters=[planner.describeFilter(f) for f in plan.pushed],
+            residualFilters=[planner.describeFilter(f) for f in plan.residual],
+            order=plan.order,
+            estimatedCost=plan.estimatedCost(page_size),
+            projection=list(plan.projection or ()),
+        )
+
+
+    def _conferencesEtag(self, conf_keys):
+        """Return the etag of a list of conferences, from their keys and
+        versions."""
+        versions = [(key.urlsafe(), self._conferenceVersion(key))
+                    for key in conf_keys]
+        return hashlib.sha1(repr(versions)).hexdigest()
+
+
+    @endpoints.method(CONF_ATTENDING_REQUEST, ConferenceForms,
                       path='conferences/attending',
                       http_method='GET', name='getConferencesToAttend')
+    @instrumented
     def getConferencesToAttend(self, request):
-        """Get list of conferences that user has registered for."""
-        prof = self._getProfileFromUser() # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
+        """Get list of conferences that user has registered for; only
+        notModified if ifNoneMatch is its current etag."""
+        if request.ifNoneMatch:
+            user = endpoints.get_current_user()
+            if not user:
+                raise endpoints.UnauthorizedException('Authorization required')
+            etag = self._conferencesEtag(self._registeredConferenceKeys(
+                ndb.Key(Profile, getUserId(user))))
+            if request.ifNoneMatch == etag:
+                return ConferenceForms(etag=etag, notModified=True)
 
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        prof = self._getProfileFromUser() # get user Profile
+        conf_keys = self._registeredConferenceKeys(prof.key)
+        etag = self._conferencesEtag(conf_keys)
 
+        # each organiser lookup starts as soon as its conference arrives
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])
-                                  for conf in conferences])
+        return ConferenceForms(items=self._conferenceFormsAsync(
+            ndb.get_multi_async(conf_keys)).get_result(), etag=etag)
 
 
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
+        # t-shirt string is converted to Enum by the compiled copier
+        return formCopier(Profile, ProfileForm)(prof)
 
 
     def _getProfileFromUser(self):
-        """Return user Profile from datastore, creating new one if non-existent."""
+        """Return user Profile, creating new one if non-existent.
+
+        Outside transactions the get is normally served by ndb's request
+        cache or memcache (see Profile); inside them from the datastore.
+        """
         # make sure user is authed
         user = endpoints.get_current_user()
         if not user:
@@ -454,6 +730,8 @@ class ConferenceApi(remote.Service):
                 teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
             )
             profile.put()
+        elif profile.conferenceKeysToAttend and not ndb.in_transaction():
+            profile = self._migrateRegistrations(p_key)
 
         return profile      # return Profile
 
@@ -465,24 +743,31 @@ class ConferenceApi(remote.Service):
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
+            changed = False
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
-                    if val:
+                    if val and getattr(prof, field) != str(val):
                         setattr(prof, field, str(val))
-                        #if field == 'teeShirtSize':
-                        #    setattr(prof, field, str(val).upper())
-                        #else:
-                        #    setattr(prof, field, val)
-                        prof.put()
-
-        # return ProfileForm
-        return self._copyProfileToForm(prof)
+                        changed = True
+            # write all changed fields at once
+            if changed:
+                prof.put()
+                # the organiser's name is part of their conferences' forms
+                for c_key in Conference.query(ancestor=prof.key).iter(keys_only=True):
+                    self._conferenceVersion(c_key, bump=True)
+
+        # return ProfileForm, with the registrations listed
+        pf = self._copyProfileToForm(prof)
+        pf.conferenceKeysToAttend = [
+            key.urlsafe() for key in self._registeredConferenceKeys(prof.key)]
+        return pf
 
 
     @endpoints.method(message_types.VoidMessage, ProfileForm,
                       path='profile',
                       http_method='GET', name='getProfile')
+    @instrumented
     def getProfile(self, request):
         """Return user profile."""
         return self._doProfile()
@@ -491,6 +776,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(ProfileMiniForm, ProfileForm,
                       path='profile',
                       http_method='POST', name='saveProfile')
+    @instrumented
     def saveProfile(self, request):
         """Update & return user profile."""
         return self._doProfile(request)
@@ -499,20 +785,126 @@ class ConferenceApi(remote.Service):
 
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
     @staticmethod
-    def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+    def _nearlySoldOut():
+        """Return {websafeConferenceKey: name} of the nearly sold out
+        conferences, read through memcache."""
+        confs = memcache.get(MEMCACHE_NEARLY_SOLD_OUT_KEY)
+        if confs is None:
+            state = ndb.Key(NearlySoldOut, 'conferences').get()
+            confs = (state and state.conferences) or {}
+            memcache.add(MEMCACHE_NEARLY_SOLD_OUT_KEY, confs)
+        return confs
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _storeNearlySoldOut(changes):
+        """Apply {websafeConferenceKey: name, or None to remove} to the
+        stored nearly sold out set and return the new set."""
+        state = (ndb.Key(NearlySoldOut, 'conferences').get() or
+                 NearlySoldOut(id='conferences'))
+        confs = state.conferences or {}
+        for wsck, name in changes.items():
+            if name is None:
+                confs.pop(wsck, None)
+            else:
+                confs[wsck] = name
+        state.conferences = confs
+        state.put()
+        return confs
+
+
+    @staticmethod
+    def _updateCachedNearlySoldOut(changes):
+        """Apply {websafeConferenceKey: name, or None to remove} to the
+        cached nearly sold out set with compare-and-set and return the new
+        set; drop the cache entry if that keeps failing. Returns None when
+        nothing is cached."""
+        client = memcache.Client()
+        for _ in range(NEARLY_SOLD_OUT_CAS_RETRIES):
+            confs = client.gets(MEMCACHE_NEARLY_SOLD_OUT_KEY)
+            if confs is None:
+                return None
+            for wsck, name in changes.items():
+                if name is None:
+                    confs.pop(wsck, None)
+                else:
+                    confs[wsck] = name
+            if client.cas(MEMCACHE_NEARLY_SOLD_OUT_KEY, confs):
+                return confs
+        memcache.delete(MEMCACHE_NEARLY_SOLD_OUT_KEY)
+        return None
+
+
+    @staticmethod
+    def _trackNearlySoldOut(conf_key, name, seats):
+        """Add or remove a conference in the nearly sold out set when its
+        seats left cross NEARLY_SOLD_OUT_SEATS, then rebuild the
+        announcement. Does nothing if membership is unchanged.
+        """
+        wsck = conf_key.urlsafe()
+        nearly = 0 < seats <= NEARLY_SOLD_OUT_SEATS
+        current = ConferenceApi._nearlySoldOut()
+        if nearly and current.get(wsck) == name or \
+                not nearly and wsck not in current:
+            return
+        changes = {wsck: name if nearly else None}
+        ConferenceApi._storeNearlySoldOut(changes)
+        ConferenceApi._cacheAnnouncement(
+            ConferenceApi._updateCachedNearlySoldOut(changes))
+
+
+    @staticmethod
+    def _reconcileNearlySoldOut():
+        """Recompute the nearly sold out set; run by cron to catch changes
+        the write paths missed.
+
+        Only candidates are checked, found with keys-only queries on the
+        stored seat counts: conferences allocated NEARLY_SOLD_OUT_SEATS or
+        fewer, and those with a seat shard down to its share of the
+        threshold (one must be, when the shards hold that few in all).
+        The members of the current set are checked as well.
+        """
+        current = ConferenceApi._nearlySoldOut()
+        keys = set(ndb.Key(urlsafe=wsck) for wsck in current)
+        keys.update(Conference.query(
+            Conference.seatsAvailable > 0,
+            Conference.seatsAvailable <= NEARLY_SOLD_OUT_SEATS).iter(keys_only=True))
+        # shard ids are '<websafeConferenceKey>-<n>'
+        keys.update(ndb.Key(urlsafe=key.id().rsplit('-', 1)[0]) for key in
+                    SeatShard.query(SeatShard.seatsAvailable <=
+                                    NEARLY_SOLD_OUT_SEATS // SEAT_SHARDS
+                                    ).iter(keys_only=True))
+
+        confs = [conf for conf in ndb.get_multi(list(keys)) if conf]
+        seats = [f.get_result() for f in
+                 [ConferenceApi._seatsAvailableAsync(conf) for conf in confs]]
+        actual = dict((conf.key.urlsafe(), conf.name)
+                      for conf, left in zip(confs, seats)
+                      if 0 < left <= NEARLY_SOLD_OUT_SEATS)
+
+        changes = dict((wsck, None) for wsck in current if wsck not in actual)
+        changes.update((wsck, name) for wsck, name in actual.items()
+                       if current.get(wsck) != name)
+        if changes:
+            ConferenceApi._storeNearlySoldOut(changes)
+            current = ConferenceApi._updateCachedNearlySoldOut(changes)
+        return ConferenceApi._cacheAnnouncement(current)
+
+
+    @staticmethod
+    def _cacheAnnouncement(confs=None):
+        """Create Announcement from the nearly sold out set & assign to
+        memcache; used by the write paths & the reconciliation cron job.
         """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
+        if confs is None:
+            confs = ConferenceApi._nearlySoldOut()
 
         if confs:
             # If there are almost sold out conferences,
             # format announcement and set it in memcache
             announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
+                ', '.join(sorted(confs.values())))
             memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
         else:
             # If there are no sold out conferences,
@@ -526,65 +918,397 @@ class ConferenceApi(remote.Service):
     @endpoints.method(message_types.VoidMessage, StringMessage,
                       path='conference/announcement/get',
                       http_method='GET', name='getAnnouncement')
+    @instrumented
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
         return StringMessage(data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
 
 
 
+# - - - Facets - - - - - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def _facetBuckets(conf):
+        """Return the (facet, value) buckets a conference is counted in."""
+        buckets = [('topics', topic) for topic in sorted(set(conf.topics or []))]
+        if conf.city:
+            buckets.append(('city', conf.city))
+        if conf.month:
+            buckets.append(('month', str(conf.month)))
+        return buckets
+
+
+    @staticmethod
+    def _addToFacets(facets, buckets, count, seats, partial=False):
+        """Add count conferences and seats to some buckets of a facets
+        dict and to its total; buckets left without conferences go. A
+        partial dict (a shard) holds deltas, so only its zero entries go."""
+        for facet, value in buckets:
+            values = facets.setdefault(facet, {})
+            entry = values.setdefault(value, [0, 0])
+            entry[0] += count
+            entry[1] += seats
+            if (entry == [0, 0]) if partial else (entry[0] <= 0):
+                del values[value]
+        total = facets.setdefault('total', [0, 0])
+        total[0] += count
+        total[1] += seats
+
+
+    @staticmethod
+    def _facetShardKeys():
+        """Return the keys of the ConferenceFacets shards.
+
+        Conference writes each add to one random shard, so they do not
+        all contend on one entity; the facets are the sum of the shards.
+        """
+        return [ndb.Key(ConferenceFacets, 'conferences-%d' % i)
+                for i in range(FACET_SHARDS)]
+
+
+    @staticmethod
+    def _mergeFacets(shards):
+        """Return the facets dict summed from ConferenceFacets shards."""
+        facets = {'total': [0, 0]}
+        for shard in shards:
+            for facet, values in (shard and shard.facets or {}).items():
+                if facet == 'total':
+                    facets['total'] = [a + b for a, b in zip(facets['total'], values)]
+                    continue
+                merged = facets.setdefault(facet, {})
+                for value, entry in values.items():
+                    merged[value] = [a + b for a, b in
+                                     zip(merged.get(value, [0, 0]), entry)]
+        # buckets left without conferences go once all shards are summed
+        for facet, values in facets.items():
+            if facet != 'total':
+                for value in [v for v, entry in values.items() if entry[0] <= 0]:
+                    del values[value]
+        return facets
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _storeFacets(changes):
+        """Apply [(buckets, count, seats)] to one random facets shard."""
+        key = random.choice(ConferenceApi._facetShardKeys())
+        state = key.get() or ConferenceFacets(key=key)
+        facets = state.facets or {}
+        for buckets, count, seats in changes:
+            ConferenceApi._addToFacets(facets, buckets, count, seats, partial=True)
+        state.facets = facets
+        state.put()
+
+
+    @staticmethod
+    def _updateCachedFacets(changes):
+        """Apply [(buckets, count, seats)] to the cached facets with
+        compare-and-set; drop the cache entry if that keeps failing."""
+        client = memcache.Client()
+        for _ in range(FACET_CAS_RETRIES):
+            facets = client.gets(MEMCACHE_FACETS_KEY)
+            if facets is None:
+                return
+            for buckets, count, seats in changes:
+                ConferenceApi._addToFacets(facets, buckets, count, seats)
+            if client.cas(MEMCACHE_FACETS_KEY, facets):
+                return
+        memcache.delete(MEMCACHE_FACETS_KEY)
+
+
+    @staticmethod
+    def _trackFacets(changes):
+        """Count conferences created or updated in the stored and cached
+        facets; changes is [(buckets, count, seats)]."""
+        ConferenceApi._storeFacets(changes)
+        ConferenceApi._updateCachedFacets(changes)
+
+
+    @staticmethod
+    def _trackFacetSeats(conf, seats):
+        """Move the seats of a registration in the cached facets only, so
+        registrations do not all write one entity; the hourly
+        recomputation brings the stored facets up to date."""
+        if seats:
+            ConferenceApi._updateCachedFacets(
+                [(ConferenceApi._facetBuckets(conf), 0, seats)])
+
+
+    @staticmethod
+    def _recomputeFacets():
+        """Rebuild the facets from every conference and its seats left;
+        run by the hourly cron to catch what the write paths missed."""
+        facets = {}
+        for conf in Conference.query().iter(batch_size=200):
+            ConferenceApi._addToFacets(
+                facets, ConferenceApi._facetBuckets(conf), 1,
+                ConferenceApi._seatsAvailableAsync(conf).get_result())
+        # the first shard holds them all; the others start again empty
+        ndb.put_multi([ConferenceFacets(key=key, facets=facets if i == 0 else {})
+                       for i, key in enumerate(ConferenceApi._facetShardKeys())])
+        # the single entity of before the facets were sharded
+        ndb.Key(ConferenceFacets, 'conferences').delete()
+        memcache.set(MEMCACHE_FACETS_KEY, facets)
+        return facets
+
+
+    @staticmethod
+    def _facets():
+        """Return the facets dict, read through memcache."""
+        facets = memcache.get(MEMCACHE_FACETS_KEY)
+        if facets is None:
+            shards = ndb.get_multi(ConferenceApi._facetShardKeys())
+            if not any(shards):
+                return ConferenceApi._recomputeFacets()
+            facets = ConferenceApi._mergeFacets(shards)
+            memcache.add(MEMCACHE_FACETS_KEY, facets)
+        return facets
+
+
+    @endpoints.method(message_types.VoidMessage, ConferenceFacetsForm,
+                      path='conferences/facets',
+                      http_method='GET', name='getConferenceFacets')
+    @instrumented
+    def getConferenceFacets(self, request):
+        """Return conference counts and seats available per city, topic
+        and month, most conferences first."""
+        facets = self._facets()
+
+        def values(facet):
+            entries = sorted(facets.get(facet, {}).items(),
+                             key=lambda item: (-item[1][0], item[0]))
+            return [FacetValueForm(value=value, count=count, seatsAvailable=seats)
+                    for value, (count, seats) in entries]
+
+        count, seats = facets.get('total', [0, 0])
+        return ConferenceFacetsForm(cities=values('city'),
+                                    topics=values('topics'),
+                                    months=values('month'),
+                                    conferenceCount=count,
+                                    seatsAvailable=seats)
+
+
+# - - - Seat shards - - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def _seatShardKeys(conf_key):
+        """Return the SeatShard keys of a Conference.
+
+        Shards are root entities so that registrations on different
+        shards do not contend on the Conference entity group.
+        """
+        wsck = conf_key.urlsafe()
+        return [ndb.Key(SeatShard, '%s-%d' % (wsck, i))
+                for i in range(SEAT_SHARDS)]
+
+
+    @staticmethod
+    def _splitSeats(seats):
+        """Split a number of seats as evenly as possible over the shards."""
+        share, extra = divmod(max(seats or 0, 0), SEAT_SHARDS)
+        return [share + (1 if i < extra else 0) for i in range(SEAT_SHARDS)]
+
+
+    @staticmethod
+    def _putSeatShards(conf, shards=None):
+        """Write seat shards holding conf.seatsAvailable.
+
+        If the current shards are given (None where missing), only the
+        missing ones are created with their share of the allocation.
+        """
+        keys = ConferenceApi._seatShardKeys(conf.key)
+        split = ConferenceApi._splitSeats(conf.seatsAvailable)
+        if shards is None:
+            shards = [None] * SEAT_SHARDS
+        ndb.put_multi([SeatShard(key=key, conference=conf.key, seatsAvailable=seats)
+                       for key, shard, seats in zip(keys, shards, split)
+                       if shard is None])
+
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _initSeatShards(conf_key):
+        """Create any missing seat shards of a Conference."""
+        conf = conf_key.get()
+        ConferenceApi._putSeatShards(
+            conf, ndb.get_multi(ConferenceApi._seatShardKeys(conf_key)))
+
+
+    @staticmethod
+    @ndb.tasklet
+    def _seatsAvailableAsync(conf):
+        """Return a Future for the seats left at a Conference.
+
+        Served from memcache; on a miss the shards are summed (missing
+        shards count with their share of the allocation) and cached.
+        """
+        ctx = ndb.get_context()
+        cache_key = MEMCACHE_SEATS_KEY % conf.key.urlsafe()
+        seats = yield ctx.memcache_get(cache_key)
+        if seats is None:
+            shards = yield ndb.get_multi_async(
+                ConferenceApi._seatShardKeys(conf.key))
+            split = ConferenceApi._splitSeats(conf.seatsAvailable)
+            seats = sum(shard.seatsAvailable if shard else share
+                        for shard, share in zip(shards, split))
+            yield ctx.memcache_add(cache_key, seats, time=SEATS_CACHE_TTL)
+        raise ndb.Return(seats)
+
+
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def _registrationKey(p_key, conf_key):
+        """Return the key of a user's Registration for a Conference."""
+        return ndb.Key(Registration, conf_key.urlsafe(), parent=p_key)
+
+
+    @staticmethod
+    def _newRegistration(p_key, conf_key):
+        """Return a new Registration of a user for a Conference."""
+        return Registration(key=ConferenceApi._registrationKey(p_key, conf_key),
+                            conference=conf_key)
+
+
+    @staticmethod
+    def _registeredConferenceKeys(p_key):
+        """Return the keys of the Conferences a user registered for, from
+        a keys-only query (the Registration id is the conference key)."""
+        return [ndb.Key(urlsafe=r_key.id()) for r_key in
+                Registration.query(ancestor=p_key).fetch(keys_only=True)]
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _migrateRegistrations(p_key):
+        """Move a Profile's legacy conferenceKeysToAttend list into
+        Registration entities; return the updated Profile."""
+        prof = p_key.get()
+        regs = [ConferenceApi._newRegistration(p_key, ndb.Key(urlsafe=wsck))
+                for wsck in prof.conferenceKeysToAttend]
+        prof.conferenceKeysToAttend = []
+        ndb.put_multi(regs + [prof])
+        return prof
+
+
+    @staticmethod
+    def _migrateAllRegistrations(cursor=None, batch=100):
+        """Migrate one page of Profiles still holding legacy registrations.
+
+        Returns (migrated, cursor); the cursor is None when done.
+        """
+        start = Cursor(urlsafe=cursor) if cursor else None
+        p_keys, next_cursor, more = Profile.query(
+            Profile.conferenceKeysToAttend > '').fetch_page(
+                batch, start_cursor=start, keys_only=True)
+        # a profile with several registrations is found once per value
+        p_keys = list(set(p_keys))
+        for p_key in p_keys:
+            ConferenceApi._migrateRegistrations(p_key)
+        return len(p_keys), next_cursor.urlsafe() if more and next_cursor else None
+
+
     @ndb.transactional(xg=True)
-    def _conferenceRegistration(self, request, reg=True):
-        """Register or unregister user for selected conference."""
-        retval = None
-        prof = self._getProfileFromUser() # get user Profile
+    def _moveSeat(self, p_key, conf_key, shard_key, reg):
+        """Move one seat between a seat shard and the user's Registration.
 
-        # check if conf exists given websafeConfKey
-        # get conference; check that it exists
-        wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % wsck)
+        Returns False if the shard has no seat left (register) or the
+        user is not registered (unregister), True otherwise.
+        """
+        r_key = self._registrationKey(p_key, conf_key)
+        registration, shard = ndb.get_multi([r_key, shard_key])
 
         # register
         if reg:
             # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if registration:
                 raise ConflictException(
                     "You have already registered for this conference")
-
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
-                raise ConflictException(
-                    "There are no seats available.")
+            if shard.seatsAvailable <= 0:
+                return False
 
             # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
+            shard.seatsAvailable -= 1
+            ndb.put_multi([self._newRegistration(p_key, conf_key), shard])
 
         # unregister
         else:
             # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            if not registration:
+                return False
 
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
-            else:
-                retval = False
+            # unregister user, add back one seat
+            shard.seatsAvailable += 1
+            shard.put()
+            r_key.delete()
+        return True
 
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
+
+    def _conferenceRegistration(self, request, reg=True):
+        """Register or unregister user for selected conference."""
+        retval = False
+        prof = self._getProfileFromUser() # get user Profile
+
+        # check if conf exists given websafeConfKey
+        # get conference; check that it exists
+        wsck = request.websafeConferenceKey
+        conf = ndb.Key(urlsafe=wsck).get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+
+        # check if user already registered
+        if reg and self._registrationKey(prof.key, conf.key).get():
+            raise ConflictException(
+                "You have already registered for this conference")
+
+        # look at all shards in one batch; create them for conferences
+        # made before seats were sharded
+        shard_keys = self._seatShardKeys(conf.key)
+        shards = ndb.get_multi(shard_keys)
+        if None in shards:
+            self._initSeatShards(conf.key)
+            shards = ndb.get_multi(shard_keys)
+        # the waitlist gets any free seats before a new registration
+        if reg and self._hasWaitlist(conf.key) and self._drainWaitlist(conf):
+            shards = ndb.get_multi(shard_keys)
+
+        # spread users over the shards at random; when registering only
+        # try shards that had seats left, each in its own transaction
+        candidates = [key for key, shard in zip(shard_keys, shards)
+                      if not reg or shard.seatsAvailable > 0]
+        random.shuffle(candidates)
+        for shard_key in candidates:
+            retval = self._moveSeat(prof.key, conf.key, shard_key, reg)
+            if retval or not reg:
+                break
+
+        if reg and not retval:
+            raise ConflictException(
+                "There are no seats available.")
+
+        # keep the cached seat count and facet seats in step
+        cache_key = MEMCACHE_SEATS_KEY % conf.key.urlsafe()
+        if retval and reg:
+            memcache.decr(cache_key)
+            self._trackFacetSeats(conf, -1)
+        elif retval:
+            memcache.incr(cache_key)
+            self._trackFacetSeats(conf, 1)
+            # hand the freed seat to the head of the waitlist
+            self._drainWaitlist(conf)
+        elif not reg:
+            # not registered; leave the waitlist instead, if on it
+            retval = self._leaveWaitlist(conf.key, prof.key.id())
+
+        if retval:
+            self._conferenceVersion(conf.key, bump=True)
+            self._trackNearlySoldOut(conf.key, conf.name,
+                                     self._seatsAvailableAsync(conf).get_result())
         return BooleanMessage(data=retval)
 
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='POST', name='registerForConference')
+    @instrumented
     def registerForConference(self, request):
         """Register user for selected conference."""
         return self._conferenceRegistration(request)
@@ -593,129 +1317,478 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='DELETE', name='unregisterFromConference')
+    @instrumented
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
         return self._conferenceRegistration(request, reg=False)
 
 
+    @endpoints.method(CONF_ROSTER_REQUEST, AttendeeForms,
+                      path='conference/{websafeConferenceKey}/attendees',
+                      http_method='GET', name='getConferenceAttendees')
+    @instrumented
+    def getConferenceAttendees(self, request):
+        """Return a page of the attendees of a conference (organiser only):
+        their display names and emails."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        if conf_key.parent().id() != getUserId(user):
+            raise endpoints.ForbiddenException(
+                'Only the organiser can see the attendees.')
+
+        r_keys, next_token = self._fetchPage(
+            Registration.query(Registration.conference == conf_key,
+                               default_options=ndb.QueryOptions(keys_only=True)),
+            request)
+        profiles = ndb.get_multi([r_key.parent() for r_key in r_keys])
+        return AttendeeForms(items=copyToForms(
+            Profile, AttendeeForm, [prof for prof in profiles if prof]),
+            nextPageToken=next_token)
+
+
+
+# - - - Admission queue - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _admitBatch(conf_key, requests):
+        """Admit a batch of (user ID, requested) in one transaction.
+
+        Users get seats in request order while the shards have any; the
+        rest join the waitlist. While anyone is waitlisted, all join it,
+        so nobody overtakes them; the caller drains the waitlist first.
+        Already registered users are skipped.
+        """
+        shards = ndb.get_multi(ConferenceApi._seatShardKeys(conf_key))
+        if ConferenceApi._hasWaitlist(conf_key):
+            shards = []
+        a_keys = [ndb.Key(Admission, uid, parent=conf_key) for uid, _ in requests]
+        r_keys = [ConferenceApi._registrationKey(ndb.Key(Profile, uid), conf_key)
+                  for uid, _ in requests]
+        regs = ndb.get_multi(r_keys)
+        adms = ndb.get_multi(a_keys)
+
+        dirty = {}
+        for a_key, r_key, (uid, requested), reg, adm in zip(
+                a_keys, r_keys, requests, regs, adms):
+            if reg or r_key in dirty or a_key in dirty:
+                # a repeated request keeps the place of the first
+                continue
+            if adm and adm.status == RegistrationStatus.WAITLISTED.name:
+                continue
+            shard = next((s for s in shards if s.seatsAvailable > 0), None)
+            if shard:
+                shard.seatsAvailable -= 1
+                dirty[shard.key] = shard
+                dirty[r_key] = ConferenceApi._newRegistration(r_key.parent(), conf_key)
+                status = RegistrationStatus.REGISTERED
+            else:
+                status = RegistrationStatus.WAITLISTED
+            dirty[a_key] = Admission(key=a_key, status=status.name,
+                                     requested=requested)
+        ndb.put_multi(dirty.values())
+
+
+    @staticmethod
+    def _processAdmissions(wsck=None):
+        """Lease queued registration requests in batches and admit them.
+
+        Works through one conference if wsck is given; otherwise each
+        lease takes the conference of the oldest queued request.
+        """
+        queue = taskqueue.Queue(ADMISSION_QUEUE)
+        while True:
+            tasks = queue.lease_tasks_by_tag(
+                ADMISSION_LEASE_SECONDS, ADMISSION_BATCH_SIZE, tag=wsck)
+            if not tasks:
+                break
+
+            conf_key = ndb.Key(urlsafe=tasks[0].tag)
+            requests = []
+            for task in tasks:
+                payload = json.loads(task.payload)
+                requests.append((payload['userId'], datetime.strptime(
+                    payload['requested'], ADMISSION_TIME_FORMAT)))
+            requests.sort(key=lambda r: r[1])
+
+            conf = conf_key.get()
+            if conf:
+                if None in ndb.get_multi(ConferenceApi._seatShardKeys(conf_key)):
+                    ConferenceApi._initSeatShards(conf_key)
+                ConferenceApi._drainWaitlist(conf)
+                before = ConferenceApi._seatsAvailableAsync(conf).get_result()
+                ConferenceApi._admitBatch(conf_key, requests)
+                memcache.delete(MEMCACHE_SEATS_KEY % conf_key.urlsafe())
+                seats = ConferenceApi._seatsAvailableAsync(conf).get_result()
+                ConferenceApi._trackFacetSeats(conf, seats - before)
+                ConferenceApi._conferenceVersion(conf_key, bump=True)
+                ConferenceApi._trackNearlySoldOut(conf_key, conf.name, seats)
+            memcache.delete_multi([MEMCACHE_ADMISSION_PENDING_KEY % (
+                conf_key.urlsafe(), uid) for uid, _ in requests])
+            queue.delete_tasks(tasks)
+
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _promoteFromWaitlist(conf_key):
+        """Give a free seat to the first user on the waitlist who is not
+        registered yet; those who registered directly in the meantime
+        leave the waitlist on the way.
+
+        Returns True if a seat was taken, False if not, or None if the
+        first ADMISSION_BATCH_SIZE users on the waitlist (the most the
+        transaction may read) were all registered already; call it again.
+        """
+        shards = ndb.get_multi(ConferenceApi._seatShardKeys(conf_key))
+        shard = next((s for s in shards if s and s.seatsAvailable > 0), None)
+        if not shard:
+            return False
+
+        settled = []
+        waitlist = Admission.query(
+            Admission.status == RegistrationStatus.WAITLISTED.name,
+            ancestor=conf_key).order(Admission.requested)
+        for adm in waitlist.iter(limit=ADMISSION_BATCH_SIZE):
+            p_key = ndb.Key(Profile, adm.key.id())
+            adm.status = RegistrationStatus.REGISTERED.name
+            settled.append(adm)
+            if not ConferenceApi._registrationKey(p_key, conf_key).get():
+                shard.seatsAvailable -= 1
+                ndb.put_multi(settled + [
+                    shard, ConferenceApi._newRegistration(p_key, conf_key)])
+                return True
+        ndb.put_multi(settled)
+        return None if len(settled) == ADMISSION_BATCH_SIZE else False
+
+
+    @staticmethod
+    def _hasWaitlist(conf_key):
+        """Return True if anyone is waitlisted for a Conference."""
+        return Admission.query(
+            Admission.status == RegistrationStatus.WAITLISTED.name,
+            ancestor=conf_key).get(keys_only=True) is not None
+
+
+    @staticmethod
+    def _drainWaitlist(conf):
+        """Seat waitlisted users in request order while a Conference has
+        free seats, and move the seats in the cached count and facets.
+        Returns the number of users seated."""
+        promoted = 0
+        while True:
+            result = ConferenceApi._promoteFromWaitlist(conf.key)
+            if result is False:
+                break
+            promoted += bool(result)
+        if promoted:
+            memcache.decr(MEMCACHE_SEATS_KEY % conf.key.urlsafe(), delta=promoted)
+            ConferenceApi._trackFacetSeats(conf, -promoted)
+        return promoted
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _leaveWaitlist(conf_key, user_id):
+        """Take a user off the waitlist; returns True if they were on it."""
+        adm = ndb.Key(Admission, user_id, parent=conf_key).get()
+        if not adm or adm.status != RegistrationStatus.WAITLISTED.name:
+            return False
+        adm.key.delete()
+        return True
+
+
+    def _registrationStatus(self, prof, conf_key):
+        """Return the RegistrationStatusForm of a user for a Conference."""
+        wsck = conf_key.urlsafe()
+        reg, adm = ndb.get_multi([
+            self._registrationKey(prof.key, conf_key),
+            ndb.Key(Admission, prof.key.id(), parent=conf_key)])
+        if reg:
+            return RegistrationStatusForm(status=RegistrationStatus.REGISTERED)
+
+        if adm and adm.status == RegistrationStatus.WAITLISTED.name:
+            ahead = Admission.query(
+                Admission.status == RegistrationStatus.WAITLISTED.name,
+                Admission.requested < adm.requested,
+                ancestor=conf_key).count()
+            return RegistrationStatusForm(
+                status=RegistrationStatus.WAITLISTED, waitlistPosition=ahead + 1)
+
+        if memcache.get(MEMCACHE_ADMISSION_PENDING_KEY % (wsck, prof.key.id())):
+            return RegistrationStatusForm(status=RegistrationStatus.PENDING)
+        return RegistrationStatusForm(status=RegistrationStatus.NOT_REGISTERED)
+
+
+    @endpoints.method(CONF_GET_REQUEST, RegistrationStatusForm,
+                      path='conference/{websafeConferenceKey}/admission',
+                      http_method='POST', name='queueRegistration')
+    @instrumented
+    def queueRegistration(self, request):
+        """Queue a registration request; poll getRegistrationStatus for
+        the outcome. Requests beyond capacity join the waitlist."""
+        prof = self._getProfileFromUser() # get user Profile
+        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+
+        status = self._registrationStatus(prof, conf.key)
+        if status.status != RegistrationStatus.NOT_REGISTERED:
+            return status
+
+        wsck = conf.key.urlsafe()
+        now = datetime.utcnow()
+        taskqueue.Queue(ADMISSION_QUEUE).add(taskqueue.Task(
+            payload=json.dumps({'userId': prof.key.id(),
+                                'requested': now.strftime(ADMISSION_TIME_FORMAT)}),
+            method='PULL', tag=wsck))
+        memcache.set(MEMCACHE_ADMISSION_PENDING_KEY % (wsck, prof.key.id()), True,
+                     time=ADMISSION_LEASE_SECONDS * 10)
+
+        # one worker run per conference per ADMISSION_BATCH_DELAY seconds
+        window = int((now - datetime(1970, 1, 1)).total_seconds()) // ADMISSION_BATCH_DELAY
+        try:
+            taskqueue.add(params={'websafeConferenceKey': wsck},
+                          url='/tasks/process_admissions',
+                          name='admissions-%s-%d' % (wsck, window),
+                          countdown=ADMISSION_BATCH_DELAY)
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            pass
+
+        return RegistrationStatusForm(status=RegistrationStatus.PENDING)
+
+
+    @endpoints.method(CONF_GET_REQUEST, RegistrationStatusForm,
+                      path='conference/{websafeConferenceKey}/admission',
+                      http_method='GET', name='getRegistrationStatus')
+    @instrumented
+    def getRegistrationStatus(self, request):
+        """Return the user's registration status for a conference."""
+        prof = self._getProfileFromUser() # get user Profile
+        return self._registrationStatus(
+            prof, ndb.Key(urlsafe=request.websafeConferenceKey))
+
+
 
 # - - - Session - - - - - - - - - - - - - - - - - - -
     def _copySessionToForm(self, sess):
         """Copy relevant fields from Session to SessionForm."""
+        # date/times are converted to strings and typeOfSession to Enum
+        # (NOT_SPECIFIED if unknown) by the compiled copier
+        return formCopier(Session, SessionForm)(sess)
 
-        sf = SessionForm()
-        for field in sf.all_fields():
-            if hasattr(sess, field.name):
-                if field.name == 'date':
-                    sf.date = str(sess.date)
-                elif field.name == 'startTime':
-                    sf.startTime = str(sess.startTime)
-                elif field.name == 'endTime':
-                    sf.endTime = str(sess.endTime)
-                elif field.name == 'duration':
-                    sf.endTime = str(sess.endTime)
-                elif field.name == 'typeOfSession':
-                    try:
-                        setattr(sf, field.name, getattr(SessionType, getattr(sess, field.name)))
-                    except AttributeError:
-                        setattr(sf, field.name, getattr(SessionType, 'NOT_SPECIFIED'))
-                else:
-                    setattr(sf, field.name, getattr(sess, field.name))
-        sf.websafeKey = sess.key.urlsafe()
-        sf.check_initialized()
 
-        return sf
+    def _copySessionsToForms(self, sessions, fields=None, **kwargs):
+        """Copy a list of Sessions to SessionForms in one batch, only the
+        fields in the mask if one is given."""
+        return SessionForms(
+            items=copyToForms(Session, SessionForm, sessions, fields), **kwargs)
 
 
-    def _createSessionObject(self, request):
-        """Create or update Session object, returning SessionForm/request."""
+    @staticmethod
+    def _scheduleVersion(conf_key, bump=False):
+        """Return (or bump and return) the version of a conference's cached
+        session schedule, which is also the etag of its session list.
+        """
+        return ConferenceApi._version(
+            MEMCACHE_SCHEDULE_VERSION_KEY % conf_key.urlsafe(), bump)
 
+
+    @staticmethod
+    def _conferenceVersion(conf_key, bump=False):
+        """Return (or bump and return) the version of a conference, bumped
+        by every change to it or to its seats; its etag."""
+        return ConferenceApi._version(
+            MEMCACHE_CONFERENCE_VERSION_KEY % conf_key.urlsafe(), bump)
+
+
+    @staticmethod
+    def _version(version_key, bump=False):
+        """Return (or bump and return) a version counter kept in memcache.
+        A lost version restarts from the clock, so it never falls back
+        onto an older version.
+        """
+        now = int((datetime.utcnow() - datetime(1970, 1, 1)).total_seconds() * 1000)
+        if bump:
+            return memcache.incr(version_key, initial_value=now)
+        version = memcache.get(version_key)
+        if version is None:
+            memcache.add(version_key, now)
+            version = memcache.get(version_key) or now
+        return version
+
+
+    @staticmethod
+    def _getConferenceSchedule(conf_key):
+        """Return all Sessions of a conference, in key order.
+
+        The list is cached in memcache as one blob of serialized entity
+        protobufs under a versioned key; _scheduleVersion(bump=True) must be
+        called whenever a session of the conference is written.
+        """
+        cache_key = MEMCACHE_SCHEDULE_KEY % (
+            conf_key.urlsafe(), ConferenceApi._scheduleVersion(conf_key))
+        blob = memcache.get(cache_key)
+        if blob is not None:
+            return [ndb.model_from_protobuf(entity_pb.EntityProto(pb))
+                    for pb in blob]
+
+        sessions = Session.query(ancestor=conf_key).fetch()
+        try:
+            memcache.set(cache_key, [ndb.model_to_protobuf(sess).Encode()
+                                     for sess in sessions])
+        except ValueError:
+            logging.warning('Schedule of %s too large to cache', conf_key)
+        return sessions
+
+
+    def _getOwnConference(self, websafeConferenceKey):
+        """Return the Conference, checking that the current user organises it."""
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         # get user ID (email)
         user_id = getUserId(user)
 
-        if not request.name:
-            raise endpoints.BadRequestException("Session 'name' field required")
-
-        #get session key
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = ndb.Key(urlsafe=websafeConferenceKey).get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % websafeConferenceKey)
 
         #get conference organizer ID (email) and compare with current user ID
         conf_organizer_id = conf.key.parent().id()
         if user_id != conf_organizer_id:
             raise endpoints.BadRequestException("Only the Conference Organizer able to create Session")
+        return conf
 
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
-        new_id = Session.allocate_ids(size=1, parent=conf.key)[0]
-        s_key = ndb.Key(Session, new_id, parent=conf.key)
+
+    def _sessionFromForm(self, form):
+        """Return a new (unkeyed) Session built from a SessionForm, filling
+        in defaults on both; raises BadRequestException if invalid.
+        """
+        if not form.name:
+            raise endpoints.BadRequestException("Session 'name' field required")
 
         #get data
-        data = {field.name: getattr(request, field.name) for field in request.all_fields() if field.name != "websafeConferenceKey"}
-        del data['websafeKey']
+        data = {field.name: getattr(form, field.name) for field in form.all_fields()
+                if field.name not in ("websafeConferenceKey", "websafeKey")}
 
         # add default values for those missing (both data model & outbound Message)
         for df in SESSION_DEFAULTS:
             if data[df] in (None, []):
                 data[df] = SESSION_DEFAULTS[df]
-                setattr(request, df, SESSION_DEFAULTS[df])
-
-        if data['date']:
-            data['date'] = datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
-        if data['startTime']:
-            data['startTime'] = int(data['startTime'])
-        if data['endTime']:
-            data['endTime'] = int(data['endTime'])
-        if data['duration']:
-            data['duration'] = int(data['duration'])
+                setattr(form, df, SESSION_DEFAULTS[df])
+
+        try:
+            if data['date']:
+                data['date'] = datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
+            for field in ('startTime', 'endTime', 'duration'):
+                data[field] = int(data[field]) if data[field] else None
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Invalid date, time or duration in session '%s'" % form.name)
         data['typeOfSession'] = str(data['typeOfSession'])
-        data['key'] = s_key
+        return Session(**data)
+
+
+    def _storeSessions(self, conf_key, sessions):
+        """Store new Sessions of a conference in one write and refresh the
+        schedule cache and featured speakers once.
+        """
+        tally = self._putSessions(conf_key, sessions)
+        version = self._scheduleVersion(conf_key, bump=True)
+        recommend.addSessions(conf_key, version, sessions)
 
-        # store Session data & return (modified) SessionForm
-        Session(**data).put()
+        # set memcache for featured speakers
+        self._cacheFeaturedSpeakers(tally)
 
-        # set memcache for featured speaker and session
-        if data['speaker'] and data['speaker'] != "Unknown":
-            taskqueue.add(params={'websafeConferenceKey': request.websafeConferenceKey,
-                                  'speaker': data['speaker']},
-                          url='/tasks/set_featured_speaker')
 
-        return self._copySessionToForm(s_key.get())
+    def _createSessionObject(self, request):
+        """Create or update Session object, returning SessionForm/request."""
+        conf = self._getOwnConference(request.websafeConferenceKey)
+        sess = self._sessionFromForm(request)
+
+        new_id = Session.allocate_ids(size=1, parent=conf.key)[0]
+        sess.key = ndb.Key(Session, new_id, parent=conf.key)
+
+        # store Session data with the speaker tally & return SessionForm
+        self._storeSessions(conf.key, [sess])
+        return self._copySessionToForm(sess)
 
 
     @endpoints.method(SESS_POST_REQUEST, SessionForm,
                       path='/conference/{websafeConferenceKey}/createsession',
                       http_method='POST', name='createSession')
+    @instrumented
     def createSession(self, request):
         """Create new Session."""
         return self._createSessionObject(request)
 
 
+    @endpoints.method(SESS_BULK_POST_REQUEST, SessionResultForms,
+                      path='/conference/{websafeConferenceKey}/createsessions',
+                      http_method='POST', name='createSessions')
+    @instrumented
+    def createSessions(self, request):
+        """Create many Sessions at once, reporting the outcome per item."""
+        if len(request.items) > MAX_BULK_SESSIONS:
+            raise endpoints.BadRequestException(
+                "At most %d sessions per request." % MAX_BULK_SESSIONS)
+        conf = self._getOwnConference(request.websafeConferenceKey)
+
+        # validate every item; bad ones are reported, not stored
+        results = []
+        sessions = []
+        for form in request.items:
+            try:
+                sessions.append(self._sessionFromForm(form))
+                results.append(SessionResultForm())
+            except endpoints.BadRequestException as e:
+                results.append(SessionResultForm(error=str(e)))
+        if not sessions:
+            return SessionResultForms(items=results)
+
+        # one id allocation and one write for the whole batch
+        first, last = Session.allocate_ids(size=len(sessions), parent=conf.key)
+        for sess, new_id in zip(sessions, range(first, last + 1)):
+            sess.key = ndb.Key(Session, new_id, parent=conf.key)
+        self._storeSessions(conf.key, sessions)
+
+        forms = iter(copyToForms(Session, SessionForm, sessions))
+        for result in results:
+            if not result.error:
+                result.session = next(forms)
+        return SessionResultForms(items=results)
+
+
     @endpoints.method(SESS_GET_REQUEST, SessionForms,
                       path='/conference/{websafeConferenceKey}/session',
                       http_method='GET', name='getConferenceSessions')
+    @instrumented
     def getConferenceSessions(self, request):
-        """Given a conference, return all sessions"""
+        """Given a conference, return all sessions"""
 
         # #get conference key
         conference_key = ndb.Key(urlsafe=request.websafeConferenceKey)
         if not conference_key:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
-        sessions_all = Session.query(ancestor=conference_key)
+        etag = str(self._scheduleVersion(conference_key))
+        if request.ifNoneMatch == etag:
+            return SessionForms(etag=etag, notModified=True)
+        sessions_all = self._getConferenceSchedule(conference_key)
 
-        return SessionForms(items=[self._copySessionToForm(sess) for sess in sessions_all])
+        return self._copySessionsToForms(sessions_all, etag=etag)
 
 
     @endpoints.method(SESS_GET_TYPE, SessionForms,
                       path='/conference/{websafeConferenceKey}/session/type/{typeOfSession}',
                       http_method='GET', name='getConferenceSessionsByType')
+    @instrumented
     def getConferenceSessionsByType(self, request):
-        """Given a conference, return all sessions of a specified type 
-        (eg lecture, keynote, workshop)
+        """Given a conference, return all sessions of a specified type 
+        (eg lecture, keynote, workshop)
         """
 
         #get conference key
@@ -724,17 +1797,19 @@ class ConferenceApi(remote.Service):
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
 
-        sessions_all = Session.query(ancestor=conference_key)
-        sessions_ByType = sessions_all.filter(Session.typeOfSession == request.typeOfSession.name)
+        sessions_all = self._getConferenceSchedule(conference_key)
+        sessions_ByType = [sess for sess in sessions_all
+                           if sess.typeOfSession == request.typeOfSession.name]
 
-        return SessionForms(items=[self._copySessionToForm(sess) for sess in sessions_ByType])
+        return self._copySessionsToForms(sessions_ByType)
 
 
     @endpoints.method(SESS_GET_SPEAKER, SessionForms,
             path='/conference/{websafeConferenceKey}/session/speaker/{speaker}',
             http_method='GET', name='getConferenceSessionsBySpeaker')
+    @instrumented
     def getSessionsBySpeaker(self, request):
-        """Given a conference, return all sessions for by Speaker"""
+        """Given a conference, return all sessions for by Speaker"""
 
         #get conference key
         conference_key = ndb.Key(urlsafe=request.websafeConferenceKey)
@@ -742,18 +1817,19 @@ class ConferenceApi(remote.Service):
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
 
-        sessions_all = Session.query(ancestor=conference_key)
-        sessions_BySpeaker = sessions_all.filter(Session.speaker == request.speaker)
+        sessions_all = self._getConferenceSchedule(conference_key)
+        sessions_BySpeaker = [sess for sess in sessions_all
+                              if sess.speaker == request.speaker]
 
-        return SessionForms(items=[self._copySessionToForm(sess) for sess in sessions_BySpeaker]
-        )
+        return self._copySessionsToForms(sessions_BySpeaker)
 
 
     @endpoints.method(SESS_GET_DATE, SessionForms,
                       path='/conference/{websafeConferenceKey}/session/date/{date}',
                       http_method='GET', name='getConferenceSessionsByDate')
+    @instrumented
     def getConferenceSessionsByDate(self, request):
-        """Given a conference, return all sessions on specific date"""
+        """Given a conference, return all sessions on specific date"""
 
         #get conference key
         conference_key = ndb.Key(urlsafe=request.websafeConferenceKey)
@@ -763,21 +1839,20 @@ class ConferenceApi(remote.Service):
 
         # transform {date} into date format
         date = datetime.strptime(request.date, '%Y-%m-%d').date()
-        print("date: ", date)
 
         # get sessions on this date
-        sessions_all = Session.query(ancestor=conference_key)
-        sessions_ByDate = sessions_all.filter(Session.date == date)
+        sessions_all = self._getConferenceSchedule(conference_key)
+        sessions_ByDate = [sess for sess in sessions_all if sess.date == date]
 
-        return SessionForms(items=[self._copySessionToForm(sess) for sess in sessions_ByDate]
-        )
+        return self._copySessionsToForms(sessions_ByDate)
 
 
     @endpoints.method(SESS_GET_TIME, SessionForms,
                       path='/conference/{websafeConferenceKey}/session/time/{startTime}/{endTime}',
                       http_method='GET', name='getConferenceSessionsByTime')
+    @instrumented
     def getConferenceSessionsByTime(self, request):
-        """Return all sessions starting between startTime and endTime"""
+        """Return all sessions starting between startTime and endTime"""
 
         # #get conference key
         conference_key = ndb.Key(urlsafe=request.websafeConferenceKey)
@@ -785,75 +1860,146 @@ class ConferenceApi(remote.Service):
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
 
-        # get sessions for conference in a time range
-        sessions_all = Session.query(ancestor=conference_key)
-        sessions_ByTime = sessions_all.filter(ndb.AND(Session.startTime >= request.startTime, Session.startTime <= request.endTime))
+        # get sessions for conference in a time range, ordered by startTime
+        sessions_all = self._getConferenceSchedule(conference_key)
+        sessions_ByTime = sorted(
+            [sess for sess in sessions_all if sess.startTime is not None and
+             request.startTime <= sess.startTime <= request.endTime],
+            key=lambda sess: sess.startTime)
 
-        return SessionForms(items=[self._copySessionToForm(sess) for sess in sessions_ByTime]
-        )
+        return self._copySessionsToForms(sessions_ByTime)
 
-    def _getSessionQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Session.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
+    def _getSessionQuery(self, request, fields=None):
+        """Return the QueryPlan of the submitted session filters, scoped
+        to a conference if websafeConferenceKey is given; a projection
+        query for a fields mask if an index allows."""
+        ancestor = None
+        if request.websafeConferenceKey:
+            ancestor = ndb.Key(urlsafe=request.websafeConferenceKey)
+        filters = self._formatFilters(request.filters, SESSION_FIELDS, Session)
+        return planner.plan(Session, filters, ['name'], ancestor=ancestor,
+                            selectivity=SESSION_SELECTIVITY,
+                            projection=self._maskProperties(Session, fields))
 
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Session.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Session.name)
-
-        # for filtr in filters:
-        #     if filtr["field"] in ["month", "maxAttendees"]:
-        #         filtr["value"] = int(filtr["value"])
-        #     formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
-        #     q = q.filter(formatted_query)
-        return q    
 
     @endpoints.method(SessionQueryForms, SessionForms,
                       path='querySessions',
                       http_method='POST', name='querySessions')
+    @instrumented
     def querySessions(self, request):
-        """Query for sessions."""
-        sessions = self._getSessionQuery(request)
+        """Query for sessions, one page at a time, optionally within one
+        conference. With explain set only the query plan is returned."""
+        page_size, cursor = self._pageParams(request)
+        fields = self._fieldMask(SessionForm, request.fields)
+        plan = self._getSessionQuery(request, fields)
+        if request.explain:
+            return SessionForms(plan=self._copyPlanToForm(plan, page_size))
+
+        sessions, next_cursor = plan.fetchPage(page_size, cursor)
+        return self._copySessionsToForms(
+            sessions, fields=fields,
+            nextPageToken=next_cursor.urlsafe() if next_cursor else None)
+
+# - - - Search - - - - - - - - - - - - - - - - - - - - - - -
+    def _searchPage(self, kind, request):
+        """Return (entities, nextPageToken) of one page of ranked search
+        results; the page token is the offset of the next page."""
+        page_size = self._pageSize(request)
+        try:
+            offset = int(request.pageToken or 0)
+        except ValueError:
+            offset = -1
+        if offset < 0:
+            raise endpoints.BadRequestException("Invalid pageToken.")
+        ancestor = None
+        if request.websafeConferenceKey:
+            ancestor = ndb.Key(urlsafe=request.websafeConferenceKey)
+
+        keys = search.search(kind, request.query, ancestor=ancestor)
+        page = [e for e in ndb.get_multi(keys[offset:offset + page_size]) if e]
+        more = len(keys) > offset + page_size
+        return page, str(offset + page_size) if more else None
+
+
+    @endpoints.method(SEARCH_REQUEST, ConferenceForms,
+                      path='search/conferences',
+                      http_method='GET', name='searchConferences')
+    @instrumented
+    def searchConferences(self, request):
+        """Search conference names, descriptions, topics and cities; every
+        word must match the start of a word, best matches first."""
+        conferences, next_token = self._searchPage('Conference', request)
+        return ConferenceForms(
+                items=self._conferenceFormsAsync(conferences).get_result(),
+                nextPageToken=next_token
+        )
 
-        # # need to fetch organiser displayName from profiles
-        # # get all keys and use get_multi for speed
-        # organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        # profiles = ndb.get_multi(organisers)
 
-        # # put display names in a dict for easier fetching
-        # names = {}
-        # for profile in profiles:
-        #     names[profile.key.id()] = profile.displayName
+    @endpoints.method(SEARCH_REQUEST, SessionForms,
+                      path='search/sessions',
+                      http_method='GET', name='searchSessions')
+    @instrumented
+    def searchSessions(self, request):
+        """Search session names, highlights, speakers, topics, types and
+        venues, optionally within one conference; best matches first."""
+        sessions, next_token = self._searchPage('Session', request)
+        return self._copySessionsToForms(sessions, nextPageToken=next_token)
 
-        # return individual ConferenceForm object per Conference
-        return SessionForms(
-                items=[self._copySessionToForm(sess) for sess in \
-                sessions]
-        )
 
 # - - - User Wishlist - - - - - - - - - - - - - - - - - - -
-    @endpoints.method(SESS_TO_WISHLIST_GET_REQUEST, BooleanMessage,
+    @endpoints.method(SESS_TO_WISHLIST_GET_REQUEST, WishlistForm,
                       path='session/{sessionKey}',
                       http_method='POST', name='addSessionToWishlist')
+    @instrumented
     def addSessionToWishlist(self, request):
-        """Add a Session To Wishlist."""
-        return self._updateWishlist(request)
+        """Add a Session To Wishlist; returns the wishlisted Sessions of
+        the same conference it overlaps."""
+        added, conflict_keys = self._updateWishlist(request)
+        conflicts = ndb.get_multi([ndb.Key(urlsafe=k) for k in conflict_keys])
+        return WishlistForm(data=added, conflicts=copyToForms(
+            Session, SessionForm, [sess for sess in conflicts if sess]))
 
 
     @endpoints.method(SESS_TO_WISHLIST_GET_REQUEST, BooleanMessage,
                       path='session/{sessionKey}',
                       http_method='DELETE', name='removeSessionFromWishlist')
+    @instrumented
     def removeSessionFromWishlist(self, request):
         """Remove session from wishlist."""
-        return self._updateWishlist(request, add=False)
+        removed, _ = self._updateWishlist(request, add=False)
+        return BooleanMessage(data=removed)
+
+
+    @staticmethod
+    def _wishlistKey(p_key, conf_key):
+        """Return the key of a user's WishlistSchedule for a conference."""
+        return ndb.Key(WishlistSchedule, conf_key.urlsafe(), parent=p_key)
+
+
+    @staticmethod
+    def _getWishlistSchedules(prof, conf_keys):
+        """Return {conf_key: WishlistSchedule} of a Profile's wishlist;
+        missing ones (wishlists from before the index) are built from
+        sessionKeysInWishlist, but not stored."""
+        schedules = dict(zip(conf_keys, ndb.get_multi(
+            [ConferenceApi._wishlistKey(prof.key, k) for k in conf_keys])))
+        missing = [k for k, wishlist in schedules.items() if wishlist is None]
+        if missing:
+            for conf_key in missing:
+                schedules[conf_key] = WishlistSchedule(
+                    key=ConferenceApi._wishlistKey(prof.key, conf_key))
+            wished = [ndb.Key(urlsafe=k) for k in prof.sessionKeysInWishlist]
+            for sess in ndb.get_multi([k for k in wished if k.parent() in missing]):
+                if sess:
+                    schedule.addSession(schedules[sess.key.parent()], sess)
+        return schedules
 
 
     @ndb.transactional(xg=True)
     def _updateWishlist(self, request, add=True):
-        """Create or update Session object, returning SessionForm/request."""
+        """Add a Session to, or remove it from, the wishlist and its
+        conference's WishlistSchedule. Returns (changed, keys of the
+        wishlisted sessions an added one overlaps)."""
 
         # preload necessary data items
         user = endpoints.get_current_user()
@@ -866,18 +2012,22 @@ class ConferenceApi(remote.Service):
         if not session:
             raise endpoints.NotFoundException(
                 'No session found with key: %s' % session)
+        conf_key = session.key.parent()
+        wishlist = self._getWishlistSchedules(prof, [conf_key])[conf_key]
 
         # add to wishlist
+        conflicts = []
         if add:
             # check if session is already registered otherwise add
             if session_key in prof.sessionKeysInWishlist:
                 raise ConflictException(
                     "You have already added this session to your wishlist")
 
-            if prof.sessionKeysInWishlist is None:
-                prof.sessionKeysInWishlist[0] = session_key
-            else:
-                prof.sessionKeysInWishlist.append(session_key)
+            interval = schedule.sessionInterval(session)
+            if interval:
+                conflicts = schedule.overlapping(wishlist, *interval)
+            prof.sessionKeysInWishlist.append(session_key)
+            schedule.addSession(wishlist, session)
             retval = True
 
         # remove
@@ -885,21 +2035,24 @@ class ConferenceApi(remote.Service):
             # check if session already in wishlist and remove
             if session_key in prof.sessionKeysInWishlist:
                 prof.sessionKeysInWishlist.remove(session_key)
+                schedule.removeSession(wishlist, session_key)
                 retval = True
             else:
                 retval = False
 
         # write things back to the datastore & return
-        prof.put()
+        ndb.put_multi([prof, wishlist])
 
-        return BooleanMessage(data=retval)
+        return retval, conflicts
 
 
     @endpoints.method(SESS_IN_WISHLIST_GET_REQUEST, SessionForms,
                       path='session/wishlist',
                       http_method='GET', name='getSessionsInWishlist')
+    @instrumented
     def getSessionsInWishlist(self, request):
-        """Get list of Sessions that user wish to attend
+        """Get list of Sessions that user wish to attend, ordered by date
+        and start time
 
             1)return a wishlist of sessions for a specific conference if
                 with key = {websafeConferenceKey}
@@ -915,54 +2068,230 @@ class ConferenceApi(remote.Service):
 
         # show all sessions for all conferences to attend
         session_wishlist_keys = [ndb.Key(urlsafe=session_key) for session_key in prof.sessionKeysInWishlist]
-        sessions_wishlist = ndb.get_multi(session_wishlist_keys)
 
         # if user wants to see selected session for a specific conference
-        # use {websafeConferenceKey} to select them
+        # use {websafeConferenceKey} to select them before fetching
         if request.websafeConferenceKey is not None:
-            output = []
             conference_key = ndb.Key(urlsafe=request.websafeConferenceKey)
-            for item in session_wishlist_keys:
-                if item.parent() == conference_key:
-                    print("item.parent: ", item.parent())
-                    output.append(item)
-            sessions_wishlist = ndb.get_multi(output)
-            return SessionForms(items=[self._copySessionToForm(sess)
-                                   for sess in sessions_wishlist])
+            session_wishlist_keys = [key for key in session_wishlist_keys
+                                     if key.parent() == conference_key]
+
+        # fetch the selected sessions in a single batch
+        sessions_wishlist = ndb.get_multi(session_wishlist_keys)
 
         # return set of SessionForm objects
-        return SessionForms(items=[self._copySessionToForm(sess)
-                                   for sess in sessions_wishlist])
+        return self._copySessionsToForms(sorted(
+            [sess for sess in sessions_wishlist if sess], key=schedule.timeOrder))
+
+
+    @endpoints.method(SESS_IN_WISHLIST_GET_REQUEST, SessionConflictForms,
+                      path='session/wishlist/conflicts',
+                      http_method='GET', name='getWishlistConflicts')
+    @instrumented
+    def getWishlistConflicts(self, request):
+        """Return every pair of overlapping Sessions in the wishlist, of
+        one conference ({websafeConferenceKey}) or all of them."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        prof = self._getProfileFromUser()
+
+        if request.websafeConferenceKey:
+            conf_keys = [ndb.Key(urlsafe=request.websafeConferenceKey)]
+        else:
+            conf_keys = sorted(set(ndb.Key(urlsafe=k).parent()
+                                   for k in prof.sessionKeysInWishlist))
+        schedules = self._getWishlistSchedules(prof, conf_keys)
+
+        # sessions overlap only within a conference's dates
+        pairs = []
+        for conf_key in conf_keys:
+            pairs.extend(schedule.conflictPairs(schedules[conf_key]))
+
+        keys = sorted(set(k for pair in pairs for k in pair))
+        sessions = [sess for sess in ndb.get_multi(
+            [ndb.Key(urlsafe=k) for k in keys]) if sess]
+        forms = dict(zip([sess.key.urlsafe() for sess in sessions],
+                         copyToForms(Session, SessionForm, sessions)))
+        return SessionConflictForms(items=[
+            SessionConflictForm(first=forms[a], second=forms[b])
+            for a, b in pairs if a in forms and b in forms])
+
+
+    @endpoints.method(SESS_SCHEDULE_REQUEST, SessionForms,
+                      path='session/wishlist/schedule',
+                      http_method='POST', name='getWishlistSchedule')
+    @instrumented
+    def getWishlistSchedule(self, request):
+        """Return the non-overlapping Sessions of the wishlist, of one
+        conference ({websafeConferenceKey}) or all, that maximise weightBy:
+        their number (COUNT), their type (TYPE) or the weights sent as
+        priorities (PRIORITY); ordered by date and start time.
+        """
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        prof = self._getProfileFromUser()
+
+        wished = set(prof.sessionKeysInWishlist)
+        conf_keys = set(ndb.Key(urlsafe=k).parent() for k in wished)
+        if request.websafeConferenceKey:
+            conf_keys &= set([ndb.Key(urlsafe=request.websafeConferenceKey)])
+
+        # the sessions come from the cached conference schedules
+        sessions = [sess for conf_key in sorted(conf_keys)
+                    for sess in self._getConferenceSchedule(conf_key)
+                    if sess.key.urlsafe() in wished]
+
+        if request.weightBy == ScheduleWeight.TYPE:
+            weight = lambda sess: SCHEDULE_TYPE_WEIGHTS.get(sess.typeOfSession, 1)
+        elif request.weightBy == ScheduleWeight.PRIORITY:
+            priorities = dict((p.sessionKey, p.weight) for p in request.priorities
+                              if p.weight is not None)
+            weight = lambda sess: priorities.get(sess.key.urlsafe(), 1)
+        else:
+            weight = lambda sess: 1
+        return self._copySessionsToForms(schedule.bestSchedule(sessions, weight))
+
+
+# - - - Recommendations - - - - - - - - - - - - - - - - - - -
+    @endpoints.method(SESS_RECOMMEND_REQUEST, SessionForms,
+                      path='session/recommended',
+                      http_method='GET', name='getRecommendedSessions')
+    @instrumented
+    def getRecommendedSessions(self, request):
+        """Return the Sessions of a conference ({websafeConferenceKey}), or
+        of the conferences the user registered for, that best match the
+        topics, speakers and types of the user's wishlist; best first.
+        """
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        prof = self._getProfileFromUser()
+        limit = self._pageSize(request)
+
+        if request.websafeConferenceKey:
+            conf_keys = [ndb.Key(urlsafe=request.websafeConferenceKey)]
+        else:
+            conf_keys = self._registeredConferenceKeys(prof.key)
+
+        wished = ndb.get_multi([ndb.Key(urlsafe=k)
+                                for k in prof.sessionKeysInWishlist])
+        profile = recommend.userProfile([sess for sess in wished if sess])
+        matrices = [recommend.featureMatrix(k, self._scheduleVersion(k),
+                                            self._getConferenceSchedule)
+                    for k in conf_keys]
+        best = recommend.recommend(matrices, profile,
+                                   set(prof.sessionKeysInWishlist), limit)
+
+        sessions = ndb.get_multi([ndb.Key(urlsafe=k) for k in best])
+        return self._copySessionsToForms([sess for sess in sessions if sess])
 
 
 # - - - Featured Speaker - - - - - - - - - - - - - - - - - - -
     @staticmethod
-    def setFeaturedSpeaker(websafeConferenceKey, speaker):
+    def _addToTally(tally, sessions):
+        """Count sessions in a SpeakerTally and re-rank its top speakers;
+        a featured speaker has at least 2 sessions.
+        """
+        counts = tally.sessionsBySpeaker or {}
+        for sess in sessions:
+            if sess.speaker and sess.speaker != SESSION_DEFAULTS['speaker']:
+                counts.setdefault(sess.speaker, []).append(sess.name)
+        tally.sessionsBySpeaker = counts
+        ranked = sorted(counts, key=lambda sp: (-len(counts[sp]), sp))
+        tally.topSpeakers = [sp for sp in ranked
+                             if len(counts[sp]) > 1][:FEATURED_SPEAKERS]
+
+
+    @staticmethod
+    def _loadTally(conf_key):
+        """Return (tally, created) for the SpeakerTally of a conference,
+        building it from its Sessions if there is none yet. Call inside a
+        transaction.
+        """
+        t_key = ndb.Key(SpeakerTally, 'speakers', parent=conf_key)
+        tally = t_key.get()
+        if tally:
+            return tally, False
+        tally = SpeakerTally(key=t_key)
+        ConferenceApi._addToTally(
+            tally, Session.query(ancestor=conf_key).fetch())
+        return tally, True
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _putSessions(conf_key, sessions):
+        """Store new Sessions of a conference in the same write as its
+        SpeakerTally; return the updated tally.
         """
-        Check a speaker in a memcache for featured speaker
-        and set him to the memcache if he is a speaker for at least 2 sessions
+        tally, _ = ConferenceApi._loadTally(conf_key)
+        ConferenceApi._addToTally(tally, sessions)
+        ndb.put_multi(sessions + [search.documentFor(sess) for sess in sessions] +
+                      [tally])
+        return tally
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _getOrBuildTally(conf_key):
+        """Return the SpeakerTally of a conference, storing it if new."""
+        tally, created = ConferenceApi._loadTally(conf_key)
+        if created:
+            tally.put()
+        return tally
+
+
+    @staticmethod
+    def _cacheFeaturedSpeakers(tally):
+        """Cache the ranked (speaker, session names) list of a tally."""
+        counts = tally.sessionsBySpeaker or {}
+        featured = [(sp, counts[sp]) for sp in tally.topSpeakers]
+        memcache.set(MEMCACHE_FEATURED_KEY % tally.key.parent().urlsafe(),
+                     featured)
+        return featured
+
+
+    @staticmethod
+    def _getFeaturedSpeakers(conf_key):
+        """Return the ranked featured speakers of a conference, reading
+        through memcache to the stored tally.
         """
+        featured = memcache.get(MEMCACHE_FEATURED_KEY % conf_key.urlsafe())
+        if featured is None:
+            featured = ConferenceApi._cacheFeaturedSpeakers(
+                ConferenceApi._getOrBuildTally(conf_key))
+        return featured
+
 
+    @staticmethod
+    def setFeaturedSpeaker(websafeConferenceKey, speaker=None):
+        """Refresh the cached featured speakers of a conference from its
+        tally; kept for tasks queued before the tally existed.
+        """
         conf_key = ndb.Key(urlsafe=websafeConferenceKey)
-        sessions = Session.query(Session.speaker == speaker, ancestor=conf_key)
-        if sessions.count() > 1:
-            featuredSpeaker_cache = "%s is a featured speaker for %s sessions!" % (speaker, sessions.count())
-            memcache.set(websafeConferenceKey, featuredSpeaker_cache)
+        ConferenceApi._cacheFeaturedSpeakers(
+            ConferenceApi._getOrBuildTally(conf_key))
 
 
-    @endpoints.method(SESSION_GET_FEATURED_SPEAKER, StringMessage,
+    @endpoints.method(SESSION_GET_FEATURED_SPEAKER, StringMessage_Featured,
             path='conference/{websafeConferenceKey}/session/speaker/featured',
             http_method='GET', name='getFeaturedSpeaker')
+    @instrumented
     def getFeaturedSpeaker(self, request):
         """Return featured speaker of a conference from memcache"""
 
-        # get conference key
-        MEMCACHE_FEATURED_KEY = request.websafeConferenceKey
-        FeaturedSpeakers = memcache.get(MEMCACHE_FEATURED_KEY)
-        if not FeaturedSpeakers:
-            FeaturedSpeakers = ''  # return empty speaker form on failure for no results
+        featured = self._getFeaturedSpeakers(
+            ndb.Key(urlsafe=request.websafeConferenceKey))
+        if not featured:
+            # return empty speaker form for no results
+            return StringMessage_Featured()
 
-        return StringMessage(data=FeaturedSpeakers)
+        speaker, session_names = featured[0]
+        return StringMessage_Featured(speaker=speaker,
+                                      sessionNames=session_names,
+                                      sessionCount=len(session_names))
 
 
 # - - - Session Inaquality Filter - - - - - - - - - - - - - - - - - - -
@@ -974,20 +2303,49 @@ class ConferenceApi(remote.Service):
         startTime=messages.IntegerField(3),
     )
 
+    @staticmethod
+    def _getSessionTimeIndex(conf_key):
+        """Return the start time index of a conference's sessions:
+        {typeOfSession: ([startTime, ...], [session id, ...])}, each sorted
+        by startTime. Built from the schedule and cached per schedule version.
+        """
+        cache_key = MEMCACHE_TIME_INDEX_KEY % (
+            conf_key.urlsafe(), ConferenceApi._scheduleVersion(conf_key))
+        index = memcache.get(cache_key)
+        if index is None:
+            entries = {}
+            for sess in ConferenceApi._getConferenceSchedule(conf_key):
+                if sess.startTime is not None:
+                    entries.setdefault(sess.typeOfSession, []).append(
+                        (sess.startTime, sess.key.id()))
+            index = {}
+            for type_, pairs in entries.items():
+                pairs.sort()
+                index[type_] = ([t for t, _ in pairs], [i for _, i in pairs])
+            memcache.set(cache_key, index)
+        return index
+
+
     @endpoints.method(SESS_FILTER_TYPE_TIME, SessionForms,
             path='conference/{websafeConferenceKey}/session/{typeOfSession}/time/{startTime}',
             http_method='GET', name='filterSessionNotTypeByTime')
+    @instrumented
     def filterSessionNotTypeByTime(self, request):
-        """Return filtered Sessions which are != type of Session and
-        != startTime
+        """Return Sessions of a conference which are not of typeOfSession
+        and start at or before startTime, ordered by startTime.
         """
-
-        type = str(request.typeOfSession)
-        sessions_noType = Session.query(ndb.OR(Session.typeOfSession < str(type),
-										Session.typeOfSession > str(type)))
-        sessions = [sess for sess in sessions_noType if sess.startTime <= request.startTime]
-
-        return SessionForms(items=[self._copySessionToForm(sess)
-                                   for sess in sessions])
+        conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+
+        # for every other type, take the prefix of its sorted start times
+        matches = []
+        for type_, (times, ids) in self._getSessionTimeIndex(conf_key).items():
+            if type_ != request.typeOfSession.name:
+                end = bisect.bisect_right(times, request.startTime)
+                matches.extend(zip(times[:end], ids[:end]))
+        matches.sort()
+
+        sessions = ndb.get_multi([ndb.Key(Session, sess_id, parent=conf_key)
+                                  for _, sess_id in matches])
+        return self._copySessionsToForms([sess for sess in sessions if sess])
 
 api = endpoints.api_server([ConferenceApi]) # register API
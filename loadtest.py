@@ -0,0 +1,590 @@
+#!/usr/bin/env python
+
+"""loadtest.py
+
+Offline load test of every ConferenceApi endpoint and the main.app
+handlers, run against the App Engine testbed stubs for the datastore,
+memcache, task queues, mail and users. Needs the App Engine SDK and its
+bundled libraries on the path, e.g.:
+
+    PYTHONPATH=$SDK:$SDK/lib/protorpc-1.0:$SDK/lib/webapp2-2.5.2:\\
+    $SDK/lib/webob-1.2.3:$SDK/lib/yaml-3.10:$SDK/lib/endpoints-1.0 \\
+        python loadtest.py --ops 2000 --baseline loadtest_baseline.json
+
+A synthetic dataset (users, conferences, sessions, registrations and
+wishlists) is created through the API, then a seeded mix of reads and
+writes is run. Push tasks are run after each call. Per endpoint the
+p50/p95/p99 latency, the throughput and the datastore & memcache RPCs per
+call are reported. With --baseline the report is compared against an
+earlier one (written if missing, or with --write-baseline) and the exit
+status is 1 on a regression.
+
+$Id$
+
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import urllib
+from collections import Counter
+from collections import defaultdict
+from datetime import date
+from datetime import timedelta
+
+os.environ.setdefault('APPLICATION_ID', 'dev~loadtest')
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import endpoints
+import webapp2
+from protorpc import message_types
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PUSH_QUEUES = ('default',)
+MAX_TASK_ROUNDS = 10        # tasks queued by tasks are run this deep
+NOISE_FLOOR_MS = 1.0        # latency changes below this never regress
+
+CITIES = ['London', 'Paris', 'Tokyo', 'Chicago', 'Berlin', 'Sydney']
+TOPICS = ['Web', 'Python', 'Mobile', 'Cloud', 'Data', 'Security', 'Design']
+WORDS = ['scaling', 'python', 'datastore', 'latency', 'mobile', 'design',
+         'testing', 'security', 'cloud', 'search', 'caching', 'queues']
+VENUES = ['Main Hall', 'Room A', 'Room B', 'Room C', 'Lab']
+SESSION_TYPES = ['WORKSHOP', 'LECTURE', 'KEYNOTE', 'PRESENTATION']
+SERVICES = ('datastore_v3', 'memcache')
+
+
+def percentile(values, p):
+    """Return the nearest-rank p-th percentile of sorted values."""
+    if not values:
+        return 0.0
+    rank = int(round(p / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(len(values) - 1, rank))]
+
+
+def login(email):
+    """Make email the user of the following endpoint calls; None for an
+    anonymous caller."""
+    os.environ['ENDPOINTS_AUTH_EMAIL'] = email or ''
+    os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'example.com' if email else ''
+    os.environ['USER_EMAIL'] = email or ''
+
+
+def callHandler(app, method, path, params=None):
+    """Run one request through a webapp2 app; raise on a 5xx answer."""
+    if method == 'GET':
+        request = webapp2.Request.blank(
+            '%s?%s' % (path, urllib.urlencode(params or {})))
+    else:
+        request = webapp2.Request.blank(path, POST=params or {})
+    response = request.get_response(app)
+    if response.status_int >= 500:
+        raise RuntimeError('%s %s: %s' % (method, path, response.status))
+    return response
+
+
+class Recorder(object):
+    """Latencies, errors and RPC counts per endpoint."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.rpcs = defaultdict(Counter)
+        self.errors = Counter()
+        self.failures = Counter()
+        self.enabled = False
+        self._current = None
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'loadtest', self._hook)
+
+    def _hook(self, service, call, request, response):
+        if self._current:
+            self.rpcs[self._current][service] += 1
+
+    def run(self, name, call):
+        """Time call as endpoint name. Endpoint errors (e.g. registering
+        twice) are counted; anything else is a failure."""
+        # every call starts like a new request: no in-context cache
+        ndb.get_context().clear_cache()
+        self._current = name if self.enabled else None
+        start = time.time()
+        try:
+            return call()
+        except endpoints.ServiceException:
+            if self.enabled:
+                self.errors[name] += 1
+        except Exception as e:
+            if not self.enabled:
+                raise
+            if not self.failures[name]:
+                sys.stderr.write('%s failed: %r\n' % (name, e))
+            self.failures[name] += 1
+        finally:
+            if self.enabled:
+                self.latencies[name].append(time.time() - start)
+            self._current = None
+
+    def report(self):
+        """Return the measurements as {endpoint: stats}."""
+        report = {}
+        for name, times in self.latencies.items():
+            times = sorted(times)
+            total = sum(times)
+            calls = len(times)
+            stats = {
+                'calls': calls,
+                'errors': self.errors[name],
+                'failures': self.failures[name],
+                'p50_ms': round(percentile(times, 50) * 1000, 3),
+                'p95_ms': round(percentile(times, 95) * 1000, 3),
+                'p99_ms': round(percentile(times, 99) * 1000, 3),
+                'calls_per_s': round(calls / total, 1) if total else 0.0,
+            }
+            for service in SERVICES:
+                stats[service] = round(
+                    self.rpcs[name][service] / float(calls), 3)
+            report[name] = stats
+        return report
+
+
+class LoadTest(object):
+    """The dataset and workload, run through ConferenceApi and main.app."""
+
+    def __init__(self, args, tb):
+        # imported once the stubs are active
+        import conference
+        import main
+        import models
+        self.c = conference
+        self.m = models
+        self.api = conference.ConferenceApi()
+        self.app = main.app
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.taskqueue = tb.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        self.rec = Recorder()
+        self.users = ['user%d@example.com' % i for i in range(args.users)]
+        self.speakers = ['Speaker %d' % i for i in range(args.speakers)]
+        self.confs = []         # [(websafeConferenceKey, organiser)]
+        self.sessions = []      # [(websafeKey, websafeConferenceKey)]
+        self.today = date.today()
+
+    # - - - helpers - - - - - - - - - - - - - - - - - - - -
+
+    def call(self, name, method, message):
+        """Call an endpoint method with a request message."""
+        return self.rec.run(name, lambda: getattr(self.api, method)(message))
+
+    def drainTasks(self):
+        """Run the queued push tasks through main.app, as the task queue
+        would; each is recorded under its url."""
+        for _ in range(MAX_TASK_ROUNDS):
+            tasks = self.taskqueue.get_filtered_tasks(queue_names=PUSH_QUEUES)
+            if not tasks:
+                return
+            for queue in PUSH_QUEUES:
+                self.taskqueue.FlushQueue(queue)
+            for task in tasks:
+                self.rec.run('task %s' % task.url, lambda: callHandler(
+                    self.app, task.method, task.url, task.extract_params()))
+
+    def words(self, n):
+        return ' '.join(self.rng.sample(WORDS, n))
+
+    def conferenceForm(self):
+        start = self.today + timedelta(days=self.rng.randint(30, 360))
+        return self.m.ConferenceForm(
+            name='%s conference' % self.words(2).title(),
+            description=self.words(5),
+            topics=self.rng.sample(TOPICS, 2),
+            city=self.rng.choice(CITIES),
+            startDate=str(start),
+            endDate=str(start + timedelta(days=self.rng.randint(0, 3))),
+            maxAttendees=self.rng.choice([10, 50, 200, 1000]))
+
+    def sessionForm(self, wsck):
+        conf = ndb.Key(urlsafe=wsck).get()
+        days = ((conf.endDate - conf.startDate).days
+                if conf.startDate and conf.endDate else 0)
+        start = self.rng.randint(8, 17) * 100 + self.rng.choice([0, 30])
+        duration = self.rng.choice([30, 60, 90])
+        return self.m.SessionForm(
+            name='%s session' % self.words(2).title(),
+            highlights=self.words(4),
+            speaker=self.rng.choice(self.speakers),
+            duration=str(duration),
+            typeOfSession=getattr(self.m.SessionType,
+                                  self.rng.choice(SESSION_TYPES)),
+            date=str((conf.startDate or self.today) +
+                     timedelta(days=self.rng.randint(0, days))),
+            startTime=str(start),
+            endTime=str(start + duration // 60 * 100 + duration % 60),
+            venue=self.rng.choice(VENUES),
+            topics=self.rng.sample(TOPICS, 1))
+
+    def pickConference(self):
+        return self.rng.choice(self.confs)
+
+    def pickUser(self):
+        user = self.rng.choice(self.users)
+        login(user)
+        return user
+
+    # - - - dataset - - - - - - - - - - - - - - - - - - - -
+
+    def seed(self):
+        """Create the dataset through the API; nothing is recorded."""
+        c = self.c
+        for _ in range(self.args.conferences):
+            login(self.rng.choice(self.users))
+            self.call('createConference', 'createConference',
+                      self.conferenceForm())
+        self.confs = [(k.urlsafe(), k.parent().id()) for k in
+                      self.m.Conference.query().fetch(keys_only=True)]
+
+        for wsck, organiser in self.confs:
+            login(organiser)
+            remaining = self.args.sessions
+            while remaining > 0:
+                n = min(remaining, c.MAX_BULK_SESSIONS)
+                forms = self.m.SessionBulkForm(
+                    items=[self.sessionForm(wsck) for _ in range(n)])
+                results = self.call(
+                    'createSessions', 'createSessions',
+                    c.SESS_BULK_POST_REQUEST.combined_message_class(
+                        items=forms.items, websafeConferenceKey=wsck))
+                self.sessions.extend((r.session.websafeKey, wsck)
+                                     for r in results.items if r.session)
+                remaining -= n
+
+        for user in self.users:
+            login(user)
+            for _ in range(self.args.registrations):
+                self.call('registerForConference', 'registerForConference',
+                          c.CONF_GET_REQUEST.combined_message_class(
+                              websafeConferenceKey=self.pickConference()[0]))
+            for _ in range(self.args.wishlist):
+                if self.sessions:
+                    self.call('addSessionToWishlist', 'addSessionToWishlist',
+                              c.SESS_TO_WISHLIST_GET_REQUEST.combined_message_class(
+                                  sessionKey=self.rng.choice(self.sessions)[0]))
+        self.drainTasks()
+
+    # - - - workload - - - - - - - - - - - - - - - - - - - -
+
+    def operations(self):
+        """Return [(weight, name, run)] of the mixed workload; run makes
+        one call with random arguments as a random user."""
+        c, m, rng = self.c, self.m, self.rng
+        V = message_types.VoidMessage
+
+        def conf(container, **kwargs):
+            return container.combined_message_class(
+                websafeConferenceKey=self.pickConference()[0], **kwargs)
+
+        def endpoint(name, build, as_organiser=False):
+            def run():
+                message = build()
+                if as_organiser:
+                    wsck = getattr(message, 'websafeConferenceKey', None)
+                    login(dict(self.confs).get(wsck))
+                else:
+                    self.pickUser()
+                return self.call(name, name, message)
+            return run
+
+        def handler(name, method, path, params=lambda: {}):
+            def run():
+                return self.rec.run(name, lambda: callHandler(
+                    self.app, method, path, params()))
+            return run
+
+        def conferenceFilters():
+            return rng.choice([
+                [('CITY', 'EQ', rng.choice(CITIES))],
+                [('TOPIC', 'EQ', rng.choice(TOPICS))],
+                [('MONTH', 'GT', str(rng.randint(1, 11)))],
+                [('CITY', 'EQ', rng.choice(CITIES)),
+                 ('TOPIC', 'EQ', rng.choice(TOPICS))],
+                [('CITY', 'EQ', rng.choice(CITIES)),
+                 ('MAX_ATTENDEES', 'GT', '40')],
+                [('CITY', 'NE', rng.choice(CITIES))],
+            ])
+
+        def queryConferences():
+            return m.ConferenceQueryForms(
+                filters=[m.ConferenceQueryForm(field=f, operator=o, value=v)
+                         for f, o, v in conferenceFilters()],
+                fields=rng.choice([[], ['name', 'city', 'startDate']]))
+
+        def querySessions():
+            filters = rng.choice([
+                [('SPEAKER', 'EQ', rng.choice(self.speakers))],
+                [('TYPE', 'EQ', rng.choice(SESSION_TYPES))],
+                [('START_TIME', 'GT', '1200')],
+                [('TYPE', 'EQ', rng.choice(SESSION_TYPES)),
+                 ('DURATION', 'LTEQ', '60')],
+            ])
+            return m.SessionQueryForms(
+                filters=[m.SessionQueryForm(field=f, operator=o, value=v)
+                         for f, o, v in filters],
+                websafeConferenceKey=rng.choice(
+                    [None, self.pickConference()[0]]))
+
+        def session():
+            return c.SESS_TO_WISHLIST_GET_REQUEST.combined_message_class(
+                sessionKey=rng.choice(self.sessions)[0])
+
+        def updateConference():
+            form = conf(c.CONF_POST_REQUEST)
+            form.description = self.words(5)
+            return form
+
+        def createSession():
+            wsck = self.pickConference()[0]
+            form = self.sessionForm(wsck)
+            message = c.SESS_POST_REQUEST.combined_message_class(
+                websafeConferenceKey=wsck)
+            for field in form.all_fields():
+                setattr(message, field.name, getattr(form, field.name))
+            return message
+
+        def createSessions():
+            wsck = self.pickConference()[0]
+            return c.SESS_BULK_POST_REQUEST.combined_message_class(
+                websafeConferenceKey=wsck,
+                items=[self.sessionForm(wsck) for _ in range(5)])
+
+        def sessionDate():
+            return conf(c.SESS_GET_DATE, date=str(
+                self.today + timedelta(days=rng.randint(30, 360))))
+
+        def sessionTime():
+            start = rng.randint(8, 16) * 100
+            return conf(c.SESS_GET_TIME, startTime=start, endTime=start + 300)
+
+        def search(in_conference):
+            def build():
+                wsck = None
+                if in_conference and rng.random() < 0.5:
+                    wsck = self.pickConference()[0]
+                return c.SEARCH_REQUEST.combined_message_class(
+                    query=self.words(rng.randint(1, 2)),
+                    websafeConferenceKey=wsck)
+            return build
+
+        def exportParams():
+            return {'websafeConferenceKey': self.pickConference()[0]}
+
+        return [
+            # reads
+            (10, 'getConference', endpoint('getConference',
+                lambda: conf(c.CONF_GET_VERSIONED_REQUEST))),
+            (2, 'getConferencesCreated', endpoint('getConferencesCreated', V)),
+            (8, 'queryConferences', endpoint('queryConferences', queryConferences)),
+            (4, 'getConferencesToAttend', endpoint('getConferencesToAttend',
+                c.CONF_ATTENDING_REQUEST.combined_message_class)),
+            (4, 'getProfile', endpoint('getProfile', V)),
+            (4, 'getAnnouncement', endpoint('getAnnouncement', V)),
+            (3, 'getConferenceFacets', endpoint('getConferenceFacets', V)),
+            (1, 'getConferenceAttendees', endpoint('getConferenceAttendees',
+                lambda: conf(c.CONF_ROSTER_REQUEST), as_organiser=True)),
+            (2, 'getRegistrationStatus', endpoint('getRegistrationStatus',
+                lambda: conf(c.CONF_GET_REQUEST))),
+            (8, 'getConferenceSessions', endpoint('getConferenceSessions',
+                lambda: conf(c.SESS_GET_REQUEST))),
+            (2, 'getConferenceSessionsByType', endpoint(
+                'getConferenceSessionsByType', lambda: conf(c.SESS_GET_TYPE,
+                    typeOfSession=getattr(m.SessionType, rng.choice(SESSION_TYPES))))),
+            (2, 'getSessionsBySpeaker', endpoint('getSessionsBySpeaker',
+                lambda: conf(c.SESS_GET_SPEAKER, speaker=rng.choice(self.speakers)))),
+            (2, 'getConferenceSessionsByDate', endpoint(
+                'getConferenceSessionsByDate', sessionDate)),
+            (2, 'getConferenceSessionsByTime', endpoint(
+                'getConferenceSessionsByTime', sessionTime)),
+            (4, 'querySessions', endpoint('querySessions', querySessions)),
+            (4, 'searchConferences', endpoint('searchConferences',
+                search(False))),
+            (3, 'searchSessions', endpoint('searchSessions', search(True))),
+            (3, 'getSessionsInWishlist', endpoint('getSessionsInWishlist',
+                lambda: conf(c.SESS_IN_WISHLIST_GET_REQUEST))),
+            (2, 'getWishlistConflicts', endpoint('getWishlistConflicts',
+                lambda: c.SESS_IN_WISHLIST_GET_REQUEST.combined_message_class())),
+            (1, 'getWishlistSchedule', endpoint('getWishlistSchedule',
+                lambda: c.SESS_SCHEDULE_REQUEST.combined_message_class(
+                    weightBy=rng.choice(list(m.ScheduleWeight))))),
+            (2, 'getRecommendedSessions', endpoint('getRecommendedSessions',
+                lambda: c.SESS_RECOMMEND_REQUEST.combined_message_class(
+                    websafeConferenceKey=rng.choice(
+                        [None, self.pickConference()[0]])))),
+            (3, 'getFeaturedSpeaker', endpoint('getFeaturedSpeaker',
+                lambda: conf(c.SESSION_GET_FEATURED_SPEAKER))),
+            (2, 'filterSessionNotTypeByTime', endpoint(
+                'filterSessionNotTypeByTime', lambda: conf(
+                    c.ConferenceApi.SESS_FILTER_TYPE_TIME,
+                    typeOfSession=getattr(m.SessionType, rng.choice(SESSION_TYPES)),
+                    startTime=rng.randint(9, 17) * 100))),
+            # writes
+            (1, 'createConference', endpoint('createConference', self.conferenceForm)),
+            (1, 'updateConference', endpoint('updateConference',
+                updateConference, as_organiser=True)),
+            (1, 'saveProfile', endpoint('saveProfile', lambda: m.ProfileMiniForm(
+                displayName='Name %d' % rng.randint(0, 999),
+                teeShirtSize=m.TeeShirtSize.M_M))),
+            (4, 'registerForConference', endpoint('registerForConference',
+                lambda: conf(c.CONF_GET_REQUEST))),
+            (2, 'unregisterFromConference', endpoint('unregisterFromConference',
+                lambda: conf(c.CONF_GET_REQUEST))),
+            (1, 'queueRegistration', endpoint('queueRegistration',
+                lambda: conf(c.CONF_GET_REQUEST))),
+            (1, 'createSession', endpoint('createSession',
+                createSession, as_organiser=True)),
+            (1, 'createSessions', endpoint('createSessions',
+                createSessions, as_organiser=True)),
+            (3, 'addSessionToWishlist', endpoint('addSessionToWishlist', session)),
+            (1, 'removeSessionFromWishlist', endpoint(
+                'removeSessionFromWishlist', session)),
+            # cron & admin handlers
+            (0.2, 'cron set_announcement', handler(
+                'cron set_announcement', 'GET', '/crons/set_announcement')),
+            (0.2, 'cron process_admissions', handler(
+                'cron process_admissions', 'GET', '/crons/process_admissions')),
+            (0.2, 'admin export', handler(
+                'admin export', 'GET', '/admin/export', exportParams)),
+        ]
+
+    def run(self):
+        """Seed the dataset, then run args.ops operations; returns the
+        report."""
+        self.seed()
+        ops = self.operations()
+        total = float(sum(weight for weight, _, _ in ops))
+        self.rec.enabled = True
+        start = time.time()
+        for _ in range(self.args.ops):
+            pick = self.rng.random() * total
+            for weight, _, run in ops:
+                pick -= weight
+                if pick < 0:
+                    break
+            run()
+            self.drainTasks()
+        wall = time.time() - start
+        self.rec.enabled = False
+        return {
+            'params': dict((k, getattr(self.args, k)) for k in (
+                'users', 'conferences', 'sessions', 'registrations',
+                'wishlist', 'speakers', 'ops', 'seed', 'require_indexes')),
+            'wall_s': round(wall, 3),
+            'ops_per_s': round(self.args.ops / wall, 1) if wall else 0.0,
+            'endpoints': self.rec.report(),
+        }
+
+
+def printReport(report):
+    print('%-32s %6s %5s %9s %9s %9s %9s %7s %7s' % (
+        'endpoint', 'calls', 'err', 'p50 ms', 'p95 ms', 'p99 ms',
+        'calls/s', 'ds/call', 'mc/call'))
+    for name, s in sorted(report['endpoints'].items()):
+        print('%-32s %6d %5d %9.2f %9.2f %9.2f %9.1f %7.2f %7.2f' % (
+            name, s['calls'], s['errors'] + s['failures'], s['p50_ms'],
+            s['p95_ms'], s['p99_ms'], s['calls_per_s'],
+            s['datastore_v3'], s['memcache']))
+    print('%d operations in %.1f s (%.1f ops/s)' % (
+        report['params']['ops'], report['wall_s'], report['ops_per_s']))
+
+
+def compare(report, baseline, tolerance):
+    """Print the endpoints that got slower or make more RPCs than in the
+    baseline; returns their number."""
+    if report['params'] != baseline.get('params'):
+        print('warning: baseline was run with %s' % baseline.get('params'))
+    regressions = 0
+    for name, s in sorted(report['endpoints'].items()):
+        base = baseline['endpoints'].get(name)
+        if not base:
+            continue
+        problems = []
+        if s['p95_ms'] > base['p95_ms'] * (1 + tolerance) and \
+                s['p95_ms'] - base['p95_ms'] > NOISE_FLOOR_MS:
+            problems.append('p95 %.2f -> %.2f ms' % (base['p95_ms'], s['p95_ms']))
+        for service in SERVICES:
+            if s[service] > base[service] * (1 + tolerance) + 0.5:
+                problems.append('%s %.2f -> %.2f RPCs/call' % (
+                    service, base[service], s[service]))
+        if s['failures'] > base['failures']:
+            problems.append('%d failures' % s['failures'])
+        if problems:
+            regressions += 1
+            print('REGRESSION %s: %s' % (name, '; '.join(problems)))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--conferences', type=int, default=20)
+    parser.add_argument('--sessions', type=int, default=15,
+                        help='sessions per conference')
+    parser.add_argument('--registrations', type=int, default=2,
+                        help='conferences registered for per user')
+    parser.add_argument('--wishlist', type=int, default=5,
+                        help='sessions in the wishlist of each user')
+    parser.add_argument('--speakers', type=int, default=20)
+    parser.add_argument('--ops', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--require-indexes', action='store_true',
+                        help='fail queries that index.yaml does not serve')
+    parser.add_argument('--report', help='write this run as JSON to a file')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--write-baseline', action='store_true',
+                        help='replace the baseline with this run')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative increase (default 0.25)')
+    args = parser.parse_args()
+
+    # deterministic shuffles inside the API too
+    random.seed(args.seed)
+
+    tb = testbed.Testbed()
+    tb.setup_env(app_id=os.environ['APPLICATION_ID'], overwrite=True)
+    tb.activate()
+    try:
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1)
+        tb.init_datastore_v3_stub(consistency_policy=policy,
+                                  require_indexes=args.require_indexes,
+                                  root_path=ROOT)
+        tb.init_memcache_stub()
+        tb.init_taskqueue_stub(root_path=ROOT)
+        tb.init_mail_stub()
+        tb.init_user_stub()
+        tb.init_app_identity_stub()
+        report = LoadTest(args, tb).run()
+    finally:
+        tb.deactivate()
+
+    printReport(report)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        if args.write_baseline or not os.path.exists(args.baseline):
+            with open(args.baseline, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            print('baseline written to %s' % args.baseline)
+        else:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            if compare(report, baseline, args.tolerance):
+                sys.exit(1)
+            print('no regressions against %s' % args.baseline)
+
+
+if __name__ == '__main__':
+    main()
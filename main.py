@@ -12,20 +12,28 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import json
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
 from conference import ConferenceApi
+import search
+import stats
+import transfer
+from stats import InstrumentedHandler
+from utils import getTokenCacheStats
 
 
-class SetAnnouncementHandler(webapp2.RequestHandler):
+class SetAnnouncementHandler(InstrumentedHandler):
     def get(self):
-        """Set Announcement in Memcache."""
-        ConferenceApi._cacheAnnouncement()
+        """Reconcile the nearly sold out set & set Announcement in Memcache,
+        and recompute the conference facets."""
+        ConferenceApi._reconcileNearlySoldOut()
+        ConferenceApi._recomputeFacets()
         self.response.set_status(204)
 
 
-class SendConfirmationEmailHandler(webapp2.RequestHandler):
+class SendConfirmationEmailHandler(InstrumentedHandler):
     def post(self):
         """Send email confirming Conference creation."""
         mail.send_mail(
@@ -39,7 +47,7 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
         )
 
 
-class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
+class SetFeaturedSpeakerHandler(InstrumentedHandler):
     def post(self):
         """Set Featured Speaker in Memcache."""
 
@@ -48,8 +56,113 @@ class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
         ConferenceApi.setFeaturedSpeaker(websafeConferenceKey, speaker)
 
 
+class ProcessAdmissionsHandler(InstrumentedHandler):
+    def get(self):
+        """Admit queued registrations of any conference (cron sweep)."""
+        ConferenceApi._processAdmissions()
+        self.response.set_status(204)
+
+    def post(self):
+        """Admit queued registrations of one conference."""
+        ConferenceApi._processAdmissions(
+            self.request.get('websafeConferenceKey'))
+
+
+class ExportHandler(InstrumentedHandler):
+    def get(self):
+        """Export one conference (websafeConferenceKey) or all of them,
+        with their sessions, as newline-delimited JSON. If there is more,
+        X-Next-Cursor holds the cursor to pass back."""
+        self.response.headers['Content-Type'] = 'application/x-ndjson'
+        cursor = transfer.exportConferences(
+            self.response.out,
+            websafeConferenceKey=self.request.get('websafeConferenceKey') or None,
+            cursor=self.request.get('cursor') or None)
+        if cursor:
+            self.response.headers['X-Next-Cursor'] = cursor
+
+
+class ImportHandler(InstrumentedHandler):
+    def post(self):
+        """Import newline-delimited JSON written by ExportHandler from line
+        'start' on; reports the line to resume from as nextLine. A bad
+        line is a 400 with its number and the nextLine to resume from."""
+        self.response.headers['Content-Type'] = 'application/json'
+        try:
+            start = int(self.request.get('start') or 0)
+        except ValueError:
+            self.response.set_status(400)
+            self.response.write(json.dumps({'error': 'start must be a number'}))
+            return
+        try:
+            imported, next_line = transfer.importEntities(
+                self.request.body_file, start=start)
+        except transfer.BadLineError as e:
+            self.response.set_status(400)
+            self.response.write(json.dumps({'imported': e.imported,
+                                            'nextLine': e.nextLine,
+                                            'line': e.line,
+                                            'error': str(e)}))
+            return
+        self.response.write(json.dumps({'imported': imported,
+                                        'nextLine': next_line}))
+
+
+class MigrateRegistrationsHandler(InstrumentedHandler):
+    def post(self):
+        """Move one page of legacy Profile.conferenceKeysToAttend lists
+        into Registration entities; repeat with nextCursor until null."""
+        migrated, cursor = ConferenceApi._migrateAllRegistrations(
+            self.request.get('cursor') or None)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({'migrated': migrated,
+                                        'nextCursor': cursor}))
+
+
+class ReindexHandler(InstrumentedHandler):
+    def post(self):
+        """Rebuild the search index of one page of 'kind' (Conference or
+        Session); repeat with nextCursor until null."""
+        kind = self.request.get('kind')
+        if kind not in ('Conference', 'Session'):
+            self.response.set_status(400)
+            self.response.write('kind must be Conference or Session')
+            return
+        indexed, cursor = search.reindex(kind, self.request.get('cursor') or None)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({'indexed': indexed,
+                                        'nextCursor': cursor}))
+
+
+class StatsHandler(InstrumentedHandler):
+    def get(self):
+        """Report the calls, errors, latency histogram, RPCs and bytes per
+        call of every API method and handler over the last 'minutes'
+        (default 15), or of one 'name' (e.g. queryConferences), and this
+        instance's OAuth token cache counters and hit rate."""
+        try:
+            minutes = int(self.request.get('minutes') or stats.DEFAULT_WINDOW)
+        except ValueError:
+            self.response.set_status(400)
+            self.response.write('minutes must be a number')
+            return
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({
+            'minutes': minutes,
+            'calls': stats.report(minutes, self.request.get('name') or None),
+            'tokenCache': getTokenCacheStats(),
+        }, sort_keys=True))
+
+
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
     ('/tasks/set_featured_speaker', SetFeaturedSpeakerHandler),
+    ('/tasks/process_admissions', ProcessAdmissionsHandler),
+    ('/crons/process_admissions', ProcessAdmissionsHandler),
+    ('/admin/export', ExportHandler),
+    ('/admin/import', ImportHandler),
+    ('/admin/migrate_registrations', MigrateRegistrationsHandler),
+    ('/admin/reindex', ReindexHandler),
+    ('/admin/stats', StatsHandler),
 ], debug=True)
@@ -27,13 +27,46 @@ class ConflictException(endpoints.ServiceException):
 # - - - Profile - - - - - - - - - - - - - - - - -
 
 class Profile(ndb.Model):
-    """Profile -- User profile object"""
+    """Profile -- User profile object
+
+    Read through ndb's in-context cache and memcache. ndb locks the
+    memcache entry while a transaction writes a Profile and clears it on
+    commit, so a rolled back write is never served from the cache.
+    """
+    _use_cache = True
+    _use_memcache = True
+    _memcache_timeout = 3600
+
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
-    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
+    conferenceKeysToAttend = ndb.StringProperty(repeated=True) # legacy, see Registration
     sessionKeysInWishlist = ndb.StringProperty(repeated=True)
 
+class Registration(ndb.Model):
+    """Registration -- a user's (parent Profile) seat at a Conference; the
+    key id is the websafeConferenceKey"""
+    conference = ndb.KeyProperty(kind='Conference', required=True)
+
+class WishlistSchedule(ndb.Model):
+    """WishlistSchedule -- the timed sessions of a user's (parent Profile)
+    wishlist in one Conference, sorted by start; the key id is the
+    websafeConferenceKey. Times are minutes, see schedule.py"""
+    starts = ndb.IntegerProperty(repeated=True, indexed=False)
+    ends = ndb.IntegerProperty(repeated=True, indexed=False)
+    maxEnds = ndb.IntegerProperty(repeated=True, indexed=False)
+    sessionKeys = ndb.StringProperty(repeated=True, indexed=False)
+
+class AttendeeForm(messages.Message):
+    """AttendeeForm -- conference attendee outbound form message"""
+    displayName = messages.StringField(1)
+    mainEmail = messages.StringField(2)
+
+class AttendeeForms(messages.Message):
+    """AttendeeForms -- multiple AttendeeForm outbound form message"""
+    items = messages.MessageField(AttendeeForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
     displayName = messages.StringField(1)
@@ -54,9 +87,10 @@ class StringMessage(messages.Message):
     data = messages.StringField(1, required=True)
 
 class StringMessage_Featured(messages.Message):
-    """StringMessage-- outbound (single) string message"""
-    sessionNames = messages.StringField(1)
+    """StringMessage_Featured-- outbound featured speaker message"""
+    sessionNames = messages.StringField(1, repeated=True)
     speaker = messages.StringField(2)
+    sessionCount = messages.IntegerField(3)
 
 
 class BooleanMessage(messages.Message):
@@ -78,6 +112,27 @@ class Conference(ndb.Model):
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
 
+class SeatShard(ndb.Model):
+    """SeatShard -- one slice of a Conference's available seats"""
+    conference      = ndb.KeyProperty(kind='Conference')
+    seatsAvailable  = ndb.IntegerProperty(default=0)
+
+class NearlySoldOut(ndb.Model):
+    """NearlySoldOut -- names of the conferences with few seats left, by
+    websafeConferenceKey"""
+    conferences     = ndb.JsonProperty()
+
+class ConferenceFacets(ndb.Model):
+    """ConferenceFacets -- one shard of the [conference count, seats
+    available] per city, topic and month, and in total"""
+    facets          = ndb.JsonProperty()
+
+class Admission(ndb.Model):
+    """Admission -- queued registration of a user (key id) for the parent
+    Conference"""
+    status          = ndb.StringProperty(required=True)
+    requested       = ndb.DateTimeProperty(required=True)
+
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
     name            = messages.StringField(1)
@@ -92,10 +147,16 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10) #DateTimeField()
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    etag            = messages.StringField(13)
+    notModified     = messages.BooleanField(14)
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    plan = messages.MessageField('QueryPlanForm', 3)
+    etag = messages.StringField(4)
+    notModified = messages.BooleanField(5)
 
 
 class ConferenceQueryForm(messages.Message):
@@ -107,6 +168,40 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
+    explain = messages.BooleanField(4)
+    fields = messages.StringField(5, repeated=True)
+
+class QueryPlanForm(messages.Message):
+    """QueryPlanForm -- outbound query plan message (explain mode)"""
+    index = messages.StringField(1)
+    pushedFilters = messages.StringField(2, repeated=True)
+    residualFilters = messages.StringField(3, repeated=True)
+    order = messages.StringField(4, repeated=True)
+    estimatedCost = messages.IntegerField(5)
+    projection = messages.StringField(6, repeated=True)
+
+
+class FacetValueForm(messages.Message):
+    """FacetValueForm -- conference count & seats of one facet value"""
+    value = messages.StringField(1)
+    count = messages.IntegerField(2)
+    seatsAvailable = messages.IntegerField(3)
+
+class ConferenceFacetsForm(messages.Message):
+    """ConferenceFacetsForm -- outbound conference facet counts message"""
+    cities = messages.MessageField(FacetValueForm, 1, repeated=True)
+    topics = messages.MessageField(FacetValueForm, 2, repeated=True)
+    months = messages.MessageField(FacetValueForm, 3, repeated=True)
+    conferenceCount = messages.IntegerField(4)
+    seatsAvailable = messages.IntegerField(5)
+
+
+class RegistrationStatusForm(messages.Message):
+    """RegistrationStatusForm -- outbound registration status message"""
+    status = messages.EnumField('RegistrationStatus', 1)
+    waitlistPosition = messages.IntegerField(2)
 
 
 # - - - Conference Atributes - - - - - - - - - - - - - - - - -
@@ -130,6 +225,14 @@ class TeeShirtSize(messages.Enum):
     XXXL_W = 15
 
 
+class RegistrationStatus(messages.Enum):
+    """RegistrationStatus -- state of a user's registration for a Conference"""
+    NOT_REGISTERED = 1
+    PENDING = 2
+    REGISTERED = 3
+    WAITLISTED = 4
+
+
 # # - - - Session - - - - - - - - - - - - - - - - -
 class Session(ndb.Model):
     """Session -- Session object"""
@@ -146,6 +249,20 @@ class Session(ndb.Model):
 
 
 
+class SpeakerTally(ndb.Model):
+    """SpeakerTally -- session names per speaker of the parent Conference"""
+    sessionsBySpeaker = ndb.JsonProperty()
+    topSpeakers       = ndb.StringProperty(repeated=True, indexed=False)
+
+
+class SearchDocument(ndb.Model):
+    """SearchDocument -- inverted index entry of the parent Conference or
+    Session: its terms and their field weights"""
+    kind    = ndb.StringProperty()
+    terms   = ndb.StringProperty(repeated=True)
+    weights = ndb.JsonProperty()
+
+
 class SessionForm(messages.Message):
     """SessionForm -- Session outbound form message"""
     name = messages.StringField(1)
@@ -164,6 +281,49 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """SessionForms -- multiple Sessions outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    plan = messages.MessageField('QueryPlanForm', 3)
+    etag = messages.StringField(4)
+    notModified = messages.BooleanField(5)
+
+class SessionBulkForm(messages.Message):
+    """SessionBulkForm -- Sessions to create in one bulk inbound message"""
+    items = messages.MessageField(SessionForm, 1, repeated=True)
+
+class SessionResultForm(messages.Message):
+    """SessionResultForm -- outcome of one Session of a bulk create"""
+    session = messages.MessageField(SessionForm, 1)
+    error = messages.StringField(2)
+
+class SessionResultForms(messages.Message):
+    """SessionResultForms -- outcomes of a bulk Session create"""
+    items = messages.MessageField(SessionResultForm, 1, repeated=True)
+
+class WishlistForm(messages.Message):
+    """WishlistForm -- outcome of adding a Session to the wishlist, with
+    the wishlisted Sessions it overlaps"""
+    data = messages.BooleanField(1)
+    conflicts = messages.MessageField(SessionForm, 2, repeated=True)
+
+class SessionConflictForm(messages.Message):
+    """SessionConflictForm -- two overlapping Sessions, earlier first"""
+    first = messages.MessageField(SessionForm, 1)
+    second = messages.MessageField(SessionForm, 2)
+
+class SessionConflictForms(messages.Message):
+    """SessionConflictForms -- overlapping Sessions of a wishlist"""
+    items = messages.MessageField(SessionConflictForm, 1, repeated=True)
+
+class SessionPriorityForm(messages.Message):
+    """SessionPriorityForm -- a user's weight for one wishlisted Session"""
+    sessionKey = messages.StringField(1)
+    weight = messages.IntegerField(2)
+
+class ScheduleRequestForm(messages.Message):
+    """ScheduleRequestForm -- how to weigh wishlisted Sessions when
+    building a schedule"""
+    weightBy = messages.EnumField('ScheduleWeight', 1, default='COUNT')
+    priorities = messages.MessageField(SessionPriorityForm, 2, repeated=True)
 
 class SessionQueryForm(messages.Message):
     """SessionQueryForm -- Session query inbound form message"""
@@ -174,6 +334,11 @@ class SessionQueryForm(messages.Message):
 class SessionQueryForms(messages.Message):
     """SessionQueryForms -- multiple SessionQueryForm inbound form message"""
     filters = messages.MessageField(SessionQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
+    websafeConferenceKey = messages.StringField(4)
+    explain = messages.BooleanField(5)
+    fields = messages.StringField(6, repeated=True)
 
 class SessionType(messages.Enum):
     """SessionTypes -- types of sessions for Conference"""
@@ -183,4 +348,8 @@ class SessionType(messages.Enum):
     KEYNOTE = 4
     PRESENTATION = 5
 
-
+class ScheduleWeight(messages.Enum):
+    """ScheduleWeight -- what a schedule built from a wishlist maximises"""
+    COUNT = 1       # number of sessions
+    TYPE = 2        # weight of their typeOfSession
+    PRIORITY = 3    # weights sent as priorities (1 if not sent)
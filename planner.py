@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+
+"""planner.py
+
+Udacity conference server-side Python App Engine query planner: pushes
+the filters a declared index can serve down to the datastore and applies
+the rest in memory with a bounded scan
+
+$Id$
+
+"""
+
+import itertools
+import operator
+import os
+
+from google.appengine.datastore import datastore_index
+from google.appengine.ext import ndb
+
+INDEX_FILE = os.path.join(os.path.dirname(__file__), 'index.yaml')
+MAX_FILTERS = 10    # subsets of the filters are enumerated
+MAX_SCAN = 500      # entities read per page for filters run in memory
+
+EQUALITY = '='
+INEQUALITIES = ('<', '<=', '>', '>=')
+
+# '!=' becomes two datastore queries without cursor support, so it
+# always runs in memory
+COMPARE = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+# rough share of entities let through by a filter, per operator
+SELECTIVITY = {'=': 0.1, '!=': 0.9, '<': 0.3, '<=': 0.3, '>': 0.3, '>=': 0.3}
+
+_declared = None
+
+
+def declaredIndexes():
+    """Return {kind: [(ancestor, ((name, direction), ...))]} read once
+    from index.yaml."""
+    global _declared
+    if _declared is None:
+        declared = {}
+        try:
+            with open(INDEX_FILE) as f:
+                defs = datastore_index.ParseIndexDefinitions(f)
+        except IOError:
+            defs = None
+        for index in (defs and defs.indexes) or []:
+            declared.setdefault(index.kind, []).append((
+                bool(index.ancestor),
+                tuple((p.name, p.direction or 'asc')
+                      for p in index.properties or [])))
+        _declared = declared
+    return _declared
+
+
+def findIndex(kind, ancestor, equalities, sort, projection=()):
+    """Return the index properties serving a query, () if the built-in
+    indexes do, or None if no declared index fits.
+
+    equalities is the set of properties with equality filters; sort the
+    properties ordered by, the inequality property first; projection the
+    properties a projection query returns.
+    """
+    sort = [name for name in sort if name not in equalities]
+    extra = set(projection) - equalities - set(sort)
+    if not sort and not extra:
+        # kind scan, or a merge join of the built-in indexes
+        return ()
+    if not ancestor and not equalities and len(sort) + len(extra) == 1:
+        return ()
+
+    # an index lists the equalities, then the sort orders, then the
+    # other projected properties
+    suffix = tuple((name, 'asc') for name in sort)
+    covered = set()
+    for idx_ancestor, props in declaredIndexes().get(kind, []):
+        n = len(props) - len(suffix) - len(extra)
+        m = len(props) - len(extra)
+        if idx_ancestor != bool(ancestor) or n < 0 or props[n:m] != suffix or \
+                set(name for name, _ in props[m:]) != extra:
+            continue
+        prefix = set(name for name, _ in props[:n])
+        if prefix == equalities:
+            return tuple(name for name, _ in props)
+        if prefix <= equalities and not extra:
+            covered |= prefix
+    if covered == equalities and not extra:
+        # indexes with the same sort suffix are merged by the datastore
+        return tuple(sorted(equalities)) + tuple(sort)
+    return None
+
+
+def normalizeFilters(model, filters):
+    """Return filters without duplicates, equalities first, each group
+    ordered by field; plus whether they contradict each other (two
+    different equality values on a single-valued property)."""
+    seen = set()
+    unique = []
+    for f in filters:
+        sig = (f['field'], f['operator'], f['value'])
+        if sig not in seen:
+            seen.add(sig)
+            unique.append(f)
+    unique.sort(key=lambda f: (f['operator'] != EQUALITY, f['field'],
+                               f['operator'], f['value']))
+
+    values = {}
+    for f in unique:
+        if f['operator'] == EQUALITY and \
+                not model._properties[f['field']]._repeated:
+            values.setdefault(f['field'], set()).add(f['value'])
+    empty = any(len(v) > 1 for v in values.values())
+    return unique, empty
+
+
+def _matches(entity, filtr):
+    """Return whether an entity passes a filter, with the datastore's
+    any-value semantics for repeated properties."""
+    value = getattr(entity, filtr['field'])
+    compare = COMPARE[filtr['operator']]
+    if isinstance(value, list):
+        return any(compare(v, filtr['value']) for v in value)
+    return compare(value, filtr['value'])
+
+
+def describeFilter(filtr):
+    """Return a filter as 'field op value'."""
+    return '%s %s %s' % (filtr['field'], filtr['operator'], filtr['value'])
+
+
+class QueryPlan(object):
+    """The filters pushed down to an index, those applied in memory and
+    the resulting sort order of a query."""
+
+    def __init__(self, model, ancestor, pushed, residual, order, index,
+                 selectivity, empty=False, projection=None):
+        self.model = model
+        self.projection = projection
+        self.ancestor = ancestor
+        self.pushed = pushed
+        self.residual = residual
+        self.order = order
+        self.index = index
+        self.selectivity = selectivity
+        self.empty = empty
+
+    def query(self):
+        """Return the datastore query of the pushed down filters."""
+        q = self.model.query(ancestor=self.ancestor,
+                             projection=self.projection or None)
+        for name in self.order:
+            q = q.order(ndb.GenericProperty(name))
+        for f in self.pushed:
+            q = q.filter(ndb.query.FilterNode(f['field'], f['operator'], f['value']))
+        return q
+
+    def matches(self, entity):
+        """Return whether an entity passes the filters run in memory."""
+        return all(_matches(entity, f) for f in self.residual)
+
+    def estimatedCost(self, page_size):
+        """Return the estimated number of entities read for one page."""
+        if self.empty:
+            return 0
+        passing = 1.0
+        for f in self.residual:
+            passing *= self.selectivity(f)
+        return int(min(MAX_SCAN, page_size / passing + 0.5))
+
+    def fetchPage(self, page_size, cursor=None, **options):
+        """Return (entities, cursor) of one page; the cursor is None on
+        the last page.
+
+        With filters run in memory at most MAX_SCAN entities are read, so
+        a page may be short while the cursor says there is more.
+        """
+        if self.empty:
+            return [], None
+        q = self.query()
+        if not self.residual:
+            items, next_cursor, more = q.fetch_page(
+                page_size, start_cursor=cursor, **options)
+            return items, next_cursor if more else None
+
+        items = []
+        it = q.iter(start_cursor=cursor, produce_cursors=True,
+                    batch_size=min(MAX_SCAN, page_size * 4), **options)
+        for scanned, entity in enumerate(it, 1):
+            if self.matches(entity):
+                items.append(entity)
+                if len(items) == page_size:
+                    break
+            if scanned == MAX_SCAN:
+                break
+        else:
+            return items, None
+        return items, it.cursor_after() if it.has_next() else None
+
+    def describe(self):
+        """Return the index of the plan as text."""
+        if self.index is None:
+            return 'none'
+        if not self.index:
+            return 'built-in'
+        return '%s(%s)' % (self.model._get_kind(), ', '.join(self.index))
+
+
+def _projectable(model, subset, residual, projection):
+    """Return the properties a projection query with the pushed down
+    subset of filters must return, or None if it cannot be one."""
+    props = set(projection) | set(f['field'] for f in residual)
+    if any(f['field'] in props for f in subset if f['operator'] == EQUALITY):
+        return None
+    if any(model._properties[name]._repeated for name in props):
+        return None
+    return props
+
+
+def plan(model, filters, order, ancestor=None, selectivity=None,
+         projection=None):
+    """Return the QueryPlan of the filters for a query ordered by order.
+
+    The most selective subset of filters that a declared or built-in
+    index serves is pushed down; the rest run in memory. selectivity
+    maps a field to the share of entities an equality on it lets through.
+    With projection (property names) a projection query is planned if an
+    index allows one, else a plan fetching whole entities.
+    """
+    filters, empty = normalizeFilters(model, filters)
+    hints = selectivity or {}
+
+    def estimate(f):
+        if f['operator'] == EQUALITY and f['field'] in hints:
+            return hints[f['field']]
+        return SELECTIVITY[f['operator']]
+
+    kind = model._get_kind()
+    pushable = [f for f in filters if f['operator'] != '!=']
+    best = {}
+    for projected in ([True, False] if projection else [False]):
+        for r in range(len(pushable), -1, -1):
+            for subset in itertools.combinations(pushable, r):
+                inequalities = set(f['field'] for f in subset
+                                   if f['operator'] in INEQUALITIES)
+                if len(inequalities) > 1:
+                    continue
+                sort = list(inequalities) + [name for name in order
+                                             if name not in inequalities]
+                equalities = set(f['field'] for f in subset
+                                 if f['operator'] == EQUALITY)
+                props = None
+                if projected:
+                    residual = [f for f in filters if f not in subset]
+                    props = _projectable(model, subset, residual, projection)
+                    if props is None:
+                        continue
+                index = findIndex(kind, ancestor, equalities, sort, props or ())
+                if index is None:
+                    continue
+                share = 1.0
+                for f in subset:
+                    share *= estimate(f)
+                if projected not in best or share < best[projected][0]:
+                    best[projected] = (share, subset, sort, index, props)
+
+    # e.g. an ancestor query with no index for its order: scan unordered
+    chosen = best.get(False, (1.0, (), [], (), None))
+    if True in best and best[True][0] <= chosen[0]:
+        # project only if no more is left to run in memory
+        chosen = best[True]
+    share, subset, sort, index, props = chosen
+    pushed = list(subset)
+    residual = [f for f in filters if f not in pushed]
+    return QueryPlan(model, ancestor, pushed, residual, sort, index,
+                     estimate, empty,
+                     projection=tuple(sorted(props)) if props else None)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+"""recommend.py
+
+Udacity conference server-side Python App Engine session recommendations:
+sessions scored against the topics, speakers and types of a user's
+wishlist with a sparse feature matrix per conference, cached in memcache
+
+$Id$
+
+"""
+
+import logging
+import math
+
+import numpy as np
+from google.appengine.api import memcache
+
+MEMCACHE_FEATURES_KEY = "SESSION_FEATURES:%s:%d"     # conference, schedule version
+
+# weight of a session feature, per kind
+FEATURE_WEIGHTS = {'topic': 1.0, 'speaker': 2.0, 'type': 0.5}
+CONFERENCE_TOPIC_WEIGHT = 0.5   # topics of the session's conference
+
+
+def sessionFeatures(sess, conference_topics=()):
+    """Return {feature: weight} of a Session; features are 'topic:web',
+    'speaker:jane doe' and 'type:workshop'."""
+    features = {}
+
+    def add(feature, weight):
+        features[feature] = features.get(feature, 0.0) + weight
+
+    for topic in conference_topics:
+        add('topic:' + topic.lower(), CONFERENCE_TOPIC_WEIGHT)
+    for topic in sess.topics or []:
+        add('topic:' + topic.lower(), FEATURE_WEIGHTS['topic'])
+    if sess.speaker:
+        add('speaker:' + sess.speaker.lower(), FEATURE_WEIGHTS['speaker'])
+    if sess.typeOfSession:
+        add('type:' + sess.typeOfSession.lower(), FEATURE_WEIGHTS['type'])
+    return features
+
+
+def userProfile(sessions):
+    """Return the profile vector of a user as {feature: weight}: the
+    summed features of the sessions in their wishlist."""
+    profile = {}
+    for sess in sessions:
+        for feature, weight in sessionFeatures(sess).items():
+            profile[feature] = profile.get(feature, 0.0) + weight
+    return profile
+
+
+def _appendRows(matrix, sessions):
+    """Add a row per new Session to a feature matrix, each scaled to unit
+    length so sessions with many features do not win by numbers."""
+    known = set(matrix['sessionKeys'])
+    index = dict((f, i) for i, f in enumerate(matrix['features']))
+    rows, cols, data = [], [], []
+    for sess in sessions:
+        session_key = sess.key.urlsafe()
+        if session_key in known:
+            continue
+        known.add(session_key)
+        row = len(matrix['sessionKeys'])
+        matrix['sessionKeys'].append(session_key)
+        features = sessionFeatures(sess, matrix['topics'])
+        norm = math.sqrt(sum(w * w for w in features.values())) or 1.0
+        for feature, weight in sorted(features.items()):
+            if feature not in index:
+                index[feature] = len(matrix['features'])
+                matrix['features'].append(feature)
+            rows.append(row)
+            cols.append(index[feature])
+            data.append(weight / norm)
+    matrix['rows'] = np.concatenate([matrix['rows'], np.array(rows, np.int32)])
+    matrix['cols'] = np.concatenate([matrix['cols'], np.array(cols, np.int32)])
+    matrix['data'] = np.concatenate([matrix['data'], np.array(data, np.float64)])
+
+
+def buildMatrix(conf, sessions):
+    """Return the feature matrix of a conference's Sessions, in coordinate
+    form: row (session), column (feature) and value arrays."""
+    matrix = {
+        'topics': list(conf.topics or []) if conf else [],
+        'sessionKeys': [],
+        'features': [],
+        'rows': np.zeros(0, np.int32),
+        'cols': np.zeros(0, np.int32),
+        'data': np.zeros(0, np.float64),
+    }
+    _appendRows(matrix, sessions)
+    return matrix
+
+
+def _cacheMatrix(cache_key, matrix):
+    """Add a feature matrix to memcache unless it is too large (1 MB)."""
+    try:
+        memcache.add(cache_key, matrix)
+    except ValueError:
+        logging.warning('Feature matrix %s too large to cache', cache_key)
+
+
+def featureMatrix(conf_key, version, loadSessions):
+    """Return the feature matrix of a conference at a schedule version,
+    read through memcache and built from loadSessions(conf_key) on a miss.
+    The version is in the cache key, so a session or topic change is
+    never served from an older matrix."""
+    cache_key = MEMCACHE_FEATURES_KEY % (conf_key.urlsafe(), version)
+    matrix = memcache.get(cache_key)
+    if matrix is None:
+        matrix = buildMatrix(conf_key.get(), loadSessions(conf_key))
+        _cacheMatrix(cache_key, matrix)
+    return matrix
+
+
+def addSessions(conf_key, version, sessions):
+    """Cache the feature matrix of a conference's new schedule version as
+    the one of the previous version plus the new Sessions. Nothing is
+    built when the previous version has no cached matrix, or when the
+    version is None (memcache failed to bump it)."""
+    if version is None:
+        return
+    wsck = conf_key.urlsafe()
+    matrix = memcache.get(MEMCACHE_FEATURES_KEY % (wsck, version - 1))
+    if matrix is not None:
+        _appendRows(matrix, sessions)
+        _cacheMatrix(MEMCACHE_FEATURES_KEY % (wsck, version), matrix)
+
+
+def scores(matrix, profile):
+    """Return the score of every session of a feature matrix: the sparse
+    matrix times the profile vector, as one NumPy batch."""
+    vector = np.array([profile.get(f, 0.0) for f in matrix['features']],
+                      np.float64)
+    if not len(matrix['data']):
+        return np.zeros(len(matrix['sessionKeys']))
+    return np.bincount(matrix['rows'],
+                       weights=matrix['data'] * vector[matrix['cols']],
+                       minlength=len(matrix['sessionKeys']))
+
+
+def recommend(matrices, profile, exclude, limit):
+    """Return the urlsafe keys of the best scoring sessions of the feature
+    matrices, at most limit and not in exclude; sessions sharing nothing
+    with the profile are never recommended. Ties keep schedule order."""
+    keys = [k for matrix in matrices for k in matrix['sessionKeys']]
+    if not keys:
+        return []
+    total = np.concatenate([scores(matrix, profile) for matrix in matrices])
+    order = np.argsort(-total, kind='mergesort')
+    best = []
+    for i in order:
+        if total[i] <= 0 or len(best) == limit:
+            break
+        if keys[i] not in exclude:
+            best.append(keys[i])
+    return best
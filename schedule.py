@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""schedule.py
+
+Udacity conference server-side Python App Engine session time intervals:
+the interval index of a user's wishlist per conference and the overlaps
+between sessions
+
+$Id$
+
+"""
+
+import bisect
+import heapq
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def _minutes(time):
+    """Return the minutes since midnight of a session time, given as HHMM
+    (1930) or, below 24, as whole hours (19). HHMM times from 0001 to 0023
+    are therefore read as hours."""
+    if time < 24:
+        return time * 60
+    return time // 100 * 60 + time % 100
+
+
+def sessionInterval(sess):
+    """Return (start, end) of a Session in minutes since 0001-01-01, or
+    None if it has no date or start time. Without an end time the
+    duration (minutes) is used."""
+    if not sess.date or sess.startTime is None:
+        return None
+    day = sess.date.toordinal() * MINUTES_PER_DAY
+    start = day + _minutes(sess.startTime)
+    if sess.endTime is not None:
+        end = day + _minutes(sess.endTime)
+    else:
+        end = start + (sess.duration or 0)
+    return start, max(start, end)
+
+
+def timeOrder(sess):
+    """Sort key of Sessions by date and time; unscheduled ones last."""
+    interval = sessionInterval(sess)
+    return (interval is None, interval or (), sess.name)
+
+
+def _reindex(wishlist):
+    """Recompute the running maximum of the end times."""
+    highest = None
+    wishlist.maxEnds = []
+    for end in wishlist.ends:
+        highest = end if highest is None else max(highest, end)
+        wishlist.maxEnds.append(highest)
+
+
+def overlapping(wishlist, start, end):
+    """Return the session keys of a WishlistSchedule overlapping [start, end).
+
+    Two binary searches bound the candidates: those starting before end,
+    from the first whose running maximum end passes start. The candidates
+    are then checked one by one, so a lookup is O(log n + k) for k
+    candidates; k can exceed the overlaps when one long session keeps the
+    running maximum up.
+    """
+    if end <= start:
+        return []
+    lo = bisect.bisect_right(wishlist.maxEnds, start)
+    hi = bisect.bisect_left(wishlist.starts, end)
+    return [wishlist.sessionKeys[i] for i in range(lo, hi)
+            if wishlist.ends[i] > max(start, wishlist.starts[i])]
+
+
+def addSession(wishlist, sess):
+    """Add a Session to a WishlistSchedule, keeping it sorted by start;
+    O(n), as the lists and the running maximum are rewritten from there.
+    Sessions without a time are not indexed."""
+    interval = sessionInterval(sess)
+    if interval is None:
+        return
+    start, end = interval
+    i = bisect.bisect_right(wishlist.starts, start)
+    wishlist.starts.insert(i, start)
+    wishlist.ends.insert(i, end)
+    wishlist.sessionKeys.insert(i, sess.key.urlsafe())
+    _reindex(wishlist)
+
+
+def removeSession(wishlist, session_key):
+    """Remove a session (urlsafe key) from a WishlistSchedule."""
+    if session_key in wishlist.sessionKeys:
+        i = wishlist.sessionKeys.index(session_key)
+        del wishlist.starts[i], wishlist.ends[i], wishlist.sessionKeys[i]
+        _reindex(wishlist)
+
+
+def conflictPairs(wishlist):
+    """Return the pairs of session keys of a WishlistSchedule that overlap,
+    the earlier starting first, in one sweep over the start times."""
+    pairs = []
+    active = []     # heap of (end, session key) of the sessions under way
+    for start, end, key in zip(wishlist.starts, wishlist.ends,
+                               wishlist.sessionKeys):
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
+        if end > start:
+            pairs.extend((other, key) for _, other in sorted(active))
+            heapq.heappush(active, (end, key))
+    return pairs
+
+
+def bestSchedule(sessions, weight):
+    """Return the non-overlapping Sessions of the largest total weight,
+    ordered by time; weight maps a Session to a number and sessions
+    weighing nothing are left out, as are those without a time.
+
+    Weighted interval scheduling: sorted by end time, each session either
+    joins the best schedule of the sessions ending by its start (found by
+    binary search) or is skipped. O(n log n).
+    """
+    timed = [(sessionInterval(sess), sess) for sess in sessions]
+    timed = sorted([t for t in timed if t[0]],
+                   key=lambda t: (t[0][1], t[0][0], t[1].name))
+    ends = [end for (_, end), _ in timed]
+
+    best = [0]          # best[j]: total weight of the first j sessions
+    previous = []       # sessions compatible with session j: the first p
+    taken = []
+    for j, ((start, _), sess) in enumerate(timed):
+        p = bisect.bisect_right(ends, start, 0, j)
+        with_j = best[p] + weight(sess)
+        previous.append(p)
+        taken.append(with_j > best[j])
+        best.append(max(best[j], with_j))
+
+    chosen = []
+    j = len(timed)
+    while j:
+        if taken[j - 1]:
+            chosen.append(timed[j - 1][1])
+            j = previous[j - 1]
+        else:
+            j -= 1
+    return sorted(chosen, key=timeOrder)
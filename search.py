@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+"""search.py
+
+Udacity conference server-side Python App Engine full-text search over
+Conferences and Sessions, kept in a datastore inverted index
+
+$Id$
+
+"""
+
+import math
+import re
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import SearchDocument
+from models import Session
+
+REINDEX_BATCH_SIZE = 100
+MAX_MATCHES = 1000      # documents read per query term
+MAX_TERMS = 200         # distinct terms indexed per document
+MAX_TERM_LENGTH = 30
+EXACT_BOOST = 2         # a term equal to the query word beats a prefix
+
+# weight of a word per field it appears in
+FIELD_WEIGHTS = {
+    'Conference': {'name': 3, 'topics': 2, 'city': 2, 'description': 1},
+    'Session': {'name': 3, 'speaker': 2, 'topics': 2,
+                'typeOfSession': 1, 'venue': 1, 'highlights': 1},
+}
+
+STOP_WORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in',
+    'is', 'it', 'of', 'on', 'or', 'the', 'to', 'with',
+))
+
+_word_re = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """Return the lower case words of text, without stop words."""
+    return [word[:MAX_TERM_LENGTH]
+            for word in _word_re.findall((text or u'').lower())
+            if word not in STOP_WORDS]
+
+
+def documentFor(entity):
+    """Return the SearchDocument of a Conference or Session: the summed
+    field weights of each of its terms, as a child of the entity."""
+    kind = entity._get_kind()
+    weights = {}
+    for field, weight in FIELD_WEIGHTS[kind].items():
+        value = getattr(entity, field)
+        text = u' '.join(value) if isinstance(value, list) else value
+        for term in tokenize(text):
+            weights[term] = weights.get(term, 0) + weight
+
+    # keep the heaviest terms of very long texts
+    terms = sorted(weights, key=lambda t: (-weights[t], t))[:MAX_TERMS]
+    return SearchDocument(
+        key=ndb.Key(SearchDocument, 'search', parent=entity.key),
+        kind=kind,
+        terms=terms,
+        weights=dict((t, weights[t]) for t in terms))
+
+
+def reindex(kind, cursor=None):
+    """Rewrite the SearchDocuments of one page of Conferences or Sessions.
+
+    Returns (indexed, cursor); the cursor is None when done.
+    """
+    model = {'Conference': Conference, 'Session': Session}[kind]
+    start = Cursor(urlsafe=cursor) if cursor else None
+    entities, next_cursor, more = model.query().fetch_page(
+        REINDEX_BATCH_SIZE, start_cursor=start)
+    ndb.put_multi([documentFor(e) for e in entities])
+    return len(entities), next_cursor.urlsafe() if more and next_cursor else None
+
+
+def _termQuery(kind, word, ancestor=None):
+    """Return a keys-only query for the documents of kind with a term
+    starting with word, below ancestor if given."""
+    return SearchDocument.query(
+        SearchDocument.kind == kind,
+        SearchDocument.terms >= word,
+        SearchDocument.terms < word + u'\ufffd',
+        ancestor=ancestor,
+        default_options=ndb.QueryOptions(keys_only=True))
+
+
+def _score(doc, words, frequencies):
+    """Return the rank of a document: per query word, the weight of its
+    best matching term, scaled down for common words."""
+    score = 0.0
+    for word in words:
+        best = max(weight * (EXACT_BOOST if term == word else 1)
+                   for term, weight in doc.weights.items()
+                   if term.startswith(word))
+        score += best * math.log(1.0 + float(MAX_MATCHES) / frequencies[word])
+    return score
+
+
+def _hasWord(doc, word):
+    return any(term.startswith(word) for term in doc.weights)
+
+
+def search(kind, text, ancestor=None):
+    """Return the keys of the entities of kind matching every word of
+    text (as a word prefix), best match first.
+
+    ancestor limits the search to the descendants of a key (the Sessions
+    of a Conference) within the index scans. At most MAX_MATCHES documents
+    are read per word. A word with more matches is checked on the
+    documents the other words found instead; only when every word has
+    more than MAX_MATCHES matches can results be missed.
+    """
+    words = sorted(set(tokenize(text)))
+    if not words:
+        return []
+
+    # one range scan of the index per word, run in parallel
+    futures = [_termQuery(kind, word, ancestor).fetch_async(MAX_MATCHES + 1)
+               for word in words]
+    matches = [set(f.get_result()) for f in futures]
+    frequencies = dict((word, min(len(m), MAX_MATCHES))
+                       for word, m in zip(words, matches))
+    complete = [m for m in matches if len(m) <= MAX_MATCHES]
+    doc_keys = set.intersection(*(complete or matches))
+
+    docs = [doc for doc in ndb.get_multi(list(doc_keys)) if doc and
+            all(_hasWord(doc, word) for word in words)]
+    ranked = sorted(docs, key=lambda doc: (-_score(doc, words, frequencies),
+                                           doc.key.parent().urlsafe()))
+    return [doc.key.parent() for doc in ranked]
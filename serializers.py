@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""serializers.py
+
+Udacity conference server-side Python App Engine entity to ProtoRPC
+form copiers, compiled once per (model, form) pair
+
+$Id$
+
+"""
+
+from protorpc import messages
+from google.appengine.ext import ndb
+
+_copiers = {}
+
+
+def _compileField(field, prop):
+    """Return a function converting a property value for a form field."""
+    if isinstance(field, messages.EnumField):
+        # stored as the enum name; unknown names fall back to the default
+        by_name = dict((name, field.type.lookup_by_name(name))
+                       for name in field.type.names())
+        default = field.default
+        return lambda value: by_name.get(value, default)
+    if (isinstance(field, messages.StringField) and
+            not isinstance(prop, ndb.StringProperty)):
+        # dates and integers are sent as strings
+        return str
+    return None
+
+
+def formCopier(model, form, fields=None):
+    """Return a function copying a model entity into a new form.
+
+    Matching fields are found and their conversions chosen once per
+    (model, form) pair, so copying an entity is a loop over plain
+    getattr calls. 'websafeKey' is filled from the entity key. fields,
+    a field mask, limits the copy to those form fields.
+    """
+    fields = frozenset(fields) if fields is not None else None
+    copier = _copiers.get((model, form, fields))
+    if copier:
+        return copier
+
+    plan = []
+    has_key = False
+    for field in form.all_fields():
+        if fields is not None and field.name not in fields:
+            continue
+        prop = model._properties.get(field.name)
+        if prop is not None:
+            plan.append((field.name, _compileField(field, prop)))
+        elif field.name == 'websafeKey':
+            has_key = True
+    required = any(field.required for field in form.all_fields())
+
+    def copier(entity, **extra):
+        kwargs = {}
+        for name, convert in plan:
+            value = getattr(entity, name)
+            kwargs[name] = convert(value) if convert else value
+        if has_key:
+            kwargs['websafeKey'] = entity.key.urlsafe()
+        kwargs.update(extra)
+        f = form(**kwargs)
+        if required:
+            f.check_initialized()
+        return f
+
+    _copiers[(model, form, fields)] = copier
+    return copier
+
+
+def copyToForms(model, form, entities, fields=None):
+    """Copy entities of model into a list of forms in one batch."""
+    copier = formCopier(model, form, fields)
+    return [copier(entity) for entity in entities]
@@ -15,4 +15,12 @@ created/forked from conference.py by wesc on 2014 may 24
 WEB_CLIENT_ID = '158163602478-nakjmhtfu5nk8rdvr3podku3h98j5bhn.apps.googleusercontent.com'
 ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
-ANDROID_AUDIENCE = WEB_CLIENT_ID
\ No newline at end of file
+ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# tokeninfo endpoint used by utils.getUserId(id_type="oauth"); point it at a
+# local stand-in to test without Google's service.
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo'
+
+# a conference is announced as nearly sold out when it has this many
+# seats left or fewer
+NEARLY_SOLD_OUT_SEATS = 5
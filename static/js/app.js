@@ -130,3 +130,46 @@ app.factory('oauth2Provider', function ($modal) {
 
     return oauth2Provider;
 });
+
+
+/**
+ * @ngdoc service
+ * @name etagCache
+ *
+ * @description
+ * Keeps the last response of the API methods that return an etag and sends it back as
+ * ifNoneMatch, so an unchanged result is not sent again.
+ *
+ */
+app.factory('etagCache', function () {
+    var responses = {};
+    var etagCache = {};
+
+    /**
+     * Invokes an API method with the etag of the response cached under cacheKey.
+     * If the server answers notModified, the callback gets the cached response instead.
+     *
+     * @param method the gapi.client.conference method
+     * @param params the request parameters
+     * @param cacheKey identifies the cached response
+     * @param callback called with the response
+     */
+    etagCache.execute = function (method, params, cacheKey, callback) {
+        var cached = responses[cacheKey];
+        if (cached) {
+            params = angular.extend({ifNoneMatch: cached.result.etag}, params);
+        }
+        method(params).execute(function (resp) {
+            if (!resp.error && resp.result) {
+                if (resp.result.notModified && cached) {
+                    resp = cached;
+                } else if (resp.result.etag) {
+                    responses[cacheKey] = resp;
+                }
+            }
+            callback(resp);
+        });
+    };
+
+    return etagCache;
+});
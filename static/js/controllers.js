@@ -249,7 +249,7 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
  * @description
  * A controller used for the Show conferences page.
  */
-conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, etagCache, HTTP_ERRORS) {
 
     /**
      * Holds the status if the query is being executed.
@@ -293,6 +293,24 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.conferences = [];
 
+    /**
+     * Holds the token for the next page of queryConferences results, if any.
+     * @type {string|null}
+     */
+    $scope.nextPageToken = null;
+
+    /**
+     * Holds the filters sent with the first page, reused for the following pages.
+     * @type {{}}
+     */
+    $scope.lastFilters = {filters: []};
+
+    /**
+     * Holds the conference counts per city, topic and month, shown next to the filters.
+     * @type {{}|null}
+     */
+    $scope.facets = null;
+
     /**
      * Holds the state if offcanvas is enabled.
      *
@@ -390,6 +408,41 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         })
     };
 
+    /**
+     * Adds an equality filter on the field for the value of a facet and runs the query.
+     *
+     * @param enumValue the enumValue of the field, e.g. 'CITY'
+     * @param value the facet value
+     */
+    $scope.addFacetFilter = function (enumValue, value) {
+        for (var i = 0; i < $scope.filtereableFields.length; i++) {
+            if ($scope.filtereableFields[i].enumValue == enumValue) {
+                $scope.filters.push({
+                    field: $scope.filtereableFields[i],
+                    operator: $scope.operators[0],
+                    value: value
+                });
+            }
+        }
+        $scope.queryConferencesAll();
+    };
+
+    /**
+     * Invokes the conference.getConferenceFacets API.
+     */
+    $scope.getConferenceFacets = function () {
+        gapi.client.conference.getConferenceFacets().
+            execute(function (resp) {
+                $scope.$apply(function () {
+                    if (resp.error) {
+                        $log.error('Failed to get the conference facets : ' + (resp.error.message || ''));
+                    } else {
+                        $scope.facets = resp.result;
+                    }
+                });
+            });
+    };
+
     /**
      * Clears all filters.
      */
@@ -416,6 +469,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         $scope.submitted = false;
         if ($scope.selectedTab == 'ALL') {
             $scope.queryConferencesAll();
+            $scope.getConferenceFacets();
         } else if ($scope.selectedTab == 'YOU_HAVE_CREATED') {
             $scope.getConferencesCreated();
         } else if ($scope.selectedTab == 'YOU_WILL_ATTEND') {
@@ -423,22 +477,39 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         }
     };
 
+    /**
+     * The ConferenceForm fields shown in the conference list; queryConferences returns only these.
+     * @type {string[]}
+     */
+    var listFields = ['websafeKey', 'name', 'city', 'startDate', 'organizerDisplayName',
+        'maxAttendees', 'seatsAvailable'];
+
     /**
      * Invokes the conference.queryConferences API.
+     *
+     * @param append if true, fetches the next page with the last filters and appends it.
      */
-    $scope.queryConferencesAll = function () {
+    $scope.queryConferencesAll = function (append) {
         var sendFilters = {
-            filters: []
+            filters: [],
+            fields: listFields
         }
-        for (var i = 0; i < $scope.filters.length; i++) {
-            var filter = $scope.filters[i];
-            if (filter.field && filter.operator && filter.value) {
-                sendFilters.filters.push({
-                    field: filter.field.enumValue,
-                    operator: filter.operator.enumValue,
-                    value: filter.value
-                });
+        if (append) {
+            sendFilters.filters = $scope.lastFilters.filters;
+            sendFilters.pageToken = $scope.nextPageToken;
+        } else {
+            for (var i = 0; i < $scope.filters.length; i++) {
+                var filter = $scope.filters[i];
+                if (filter.field && filter.operator && filter.value) {
+                    sendFilters.filters.push({
+                        field: filter.field.enumValue,
+                        operator: filter.operator.enumValue,
+                        value: filter.value
+                    });
+                }
             }
+            $scope.lastFilters = sendFilters;
+            $scope.nextPageToken = null;
         }
         $scope.loading = true;
         gapi.client.conference.queryConferences(sendFilters).
@@ -458,16 +529,38 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
+                        if (!append) {
+                            $scope.conferences = [];
+                        }
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        $scope.nextPageToken = resp.result.nextPageToken || null;
                     }
                     $scope.submitted = true;
                 });
             });
     }
 
+    /**
+     * Loads the next page of conferences when the user scrolls near the bottom of the page.
+     */
+    var loadNextPageOnScroll = function () {
+        if ($scope.selectedTab != 'ALL' || $scope.loading || !$scope.nextPageToken) {
+            return;
+        }
+        var $window = jQuery(window);
+        if ($window.scrollTop() + $window.height() >= jQuery(document).height() - 100) {
+            $scope.$apply(function () {
+                $scope.queryConferencesAll(true);
+            });
+        }
+    };
+    jQuery(window).on('scroll', loadNextPageOnScroll);
+    $scope.$on('$destroy', function () {
+        jQuery(window).off('scroll', loadNextPageOnScroll);
+    });
+
     /**
      * Invokes the conference.getConferencesCreated method.
      */
@@ -511,8 +604,8 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.getConferencesAttend = function () {
         $scope.loading = true;
-        gapi.client.conference.getConferencesToAttend().
-            execute(function (resp) {
+        etagCache.execute(gapi.client.conference.getConferencesToAttend, {}, 'conferencesToAttend',
+            function (resp) {
                 $scope.$apply(function () {
                     if (resp.error) {
                         // The request has failed.
@@ -547,7 +640,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
  * @description
  * A controller used for the conference detail page.
  */
-conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, etagCache, HTTP_ERRORS) {
     $scope.conference = {};
 
     $scope.isUserAttending = false;
@@ -559,9 +652,9 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
      */
     $scope.init = function () {
         $scope.loading = true;
-        gapi.client.conference.getConference({
+        etagCache.execute(gapi.client.conference.getConference, {
             websafeConferenceKey: $routeParams.websafeConferenceKey
-        }).execute(function (resp) {
+        }, 'conference:' + $routeParams.websafeConferenceKey, function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
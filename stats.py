@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+
+"""stats.py
+
+Udacity conference server-side Python App Engine per-endpoint
+instrumentation: RPC counts, bytes and wall time of every API call and
+handler, kept as per-minute histograms in memcache
+
+$Id$
+
+"""
+
+import functools
+import threading
+import time
+
+import webapp2
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+MEMCACHE_STATS_KEY = "STATS:%d:%s:%s"       # minute, call name, metric
+MEMCACHE_STATS_NAMES_KEY = "STATS_NAMES"
+STATS_TTL = 2 * 60 * 60         # seconds a minute's counters are kept
+FLUSH_INTERVAL = 10             # seconds counters are buffered per instance
+NAMES_CAS_RETRIES = 5
+DEFAULT_WINDOW = 15             # minutes reported by default
+MAX_WINDOW = 120
+
+# upper bounds (ms) of the latency histogram buckets; the last is open
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# RPC kind per (service, method); other methods of a service count
+# under the service name
+RPC_KINDS = {
+    ('datastore_v3', 'Get'): 'datastore.get',
+    ('datastore_v3', 'RunQuery'): 'datastore.query',
+    ('datastore_v3', 'Next'): 'datastore.next',
+    ('datastore_v3', 'Put'): 'datastore.put',
+    ('datastore_v3', 'Delete'): 'datastore.delete',
+    ('datastore_v3', 'BeginTransaction'): 'datastore.txn',
+    ('datastore_v3', 'Commit'): 'datastore.commit',
+    ('datastore_v3', 'AllocateIds'): 'datastore.allocate',
+    ('taskqueue', 'Add'): 'taskqueue.add',
+    ('taskqueue', 'BulkAdd'): 'taskqueue.add',
+}
+SERVICES = {'datastore_v3': 'datastore', 'memcache': 'memcache',
+            'taskqueue': 'taskqueue', 'mail': 'mail'}
+RPC_METRICS = sorted(set(RPC_KINDS.values()) | set(SERVICES.values()) |
+                     set(['other']))
+HISTOGRAM_METRICS = ['ms.%d' % b for b in BUCKETS] + ['ms.inf']
+
+_local = threading.local()
+_lock = threading.Lock()
+_buffer = {}            # {(minute, name, metric): delta}
+_published = set()      # names this instance added to STATS_NAMES
+_last_flush = [time.time()]
+
+
+def _rpcKind(service, call):
+    if (service, call) in RPC_KINDS:
+        return RPC_KINDS[(service, call)]
+    return SERVICES.get(service, 'other')
+
+
+def _preCall(service, call, request, response):
+    counters = getattr(_local, 'counters', None)
+    if counters is not None:
+        kind = _rpcKind(service, call)
+        counters[kind] = counters.get(kind, 0) + 1
+        counters['bytesSent'] = counters.get('bytesSent', 0) + request.ByteSize()
+
+
+def _postCall(service, call, request, response):
+    counters = getattr(_local, 'counters', None)
+    if counters is not None:
+        counters['bytesReceived'] = \
+            counters.get('bytesReceived', 0) + response.ByteSize()
+
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('stats', _preCall)
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append('stats', _postCall)
+
+
+def bucketFor(ms):
+    """Return the histogram bucket of a latency: its upper bound, or 'inf'."""
+    for bound in BUCKETS:
+        if ms < bound:
+            return str(bound)
+    return 'inf'
+
+
+def _record(name, counters, ms, failed):
+    """Add one call to the instance buffer; flush it now and then."""
+    minute = int(time.time() // 60)
+    counters['calls'] = 1
+    counters['ms'] = int(ms + 0.5)
+    counters['ms.' + bucketFor(ms)] = 1
+    if failed:
+        counters['errors'] = 1
+    with _lock:
+        for metric, delta in counters.items():
+            key = (minute, name, metric)
+            _buffer[key] = _buffer.get(key, 0) + delta
+        due = time.time() - _last_flush[0] >= FLUSH_INTERVAL
+        if due:
+            _last_flush[0] = time.time()
+    if due:
+        flush()
+
+
+def flush():
+    """Add the buffered counters to memcache."""
+    with _lock:
+        pending = dict(_buffer)
+        _buffer.clear()
+        names = set(name for _, name, _ in pending) - _published
+        _published.update(names)
+    if pending:
+        deltas = dict((MEMCACHE_STATS_KEY % key, delta)
+                      for key, delta in pending.items())
+        # offset_multi cannot set an expiry; create the counters first
+        memcache.add_multi(dict.fromkeys(deltas, 0), time=STATS_TTL)
+        memcache.offset_multi(deltas)
+    if names:
+        _publishNames(names)
+
+
+def _publishNames(names):
+    """Add call names to the list the stats handler reads."""
+    client = memcache.Client()
+    for _ in range(NAMES_CAS_RETRIES):
+        known = client.gets(MEMCACHE_STATS_NAMES_KEY)
+        if known is None:
+            if client.add(MEMCACHE_STATS_NAMES_KEY, sorted(names)):
+                return
+            continue
+        if names <= set(known):
+            return
+        if client.cas(MEMCACHE_STATS_NAMES_KEY, sorted(names | set(known))):
+            return
+    with _lock:
+        _published.difference_update(names)
+
+
+def measure(name, func, *args, **kwargs):
+    """Call func, recording its RPCs and wall time under name. Calls made
+    within another measured call count towards the outer one."""
+    if getattr(_local, 'counters', None) is not None:
+        return func(*args, **kwargs)
+    _local.counters = counters = {}
+    start = time.time()
+    failed = True
+    try:
+        result = func(*args, **kwargs)
+        failed = False
+        return result
+    finally:
+        _local.counters = None
+        _record(name, counters, (time.time() - start) * 1000, failed)
+
+
+def instrumented(method):
+    """Decorator recording the RPCs and wall time of an API method; goes
+    below @endpoints.method."""
+    @functools.wraps(method)
+    def wrapper(self, request):
+        return measure(method.__name__, method, self, request)
+    return wrapper
+
+
+class InstrumentedHandler(webapp2.RequestHandler):
+    """RequestHandler recording every request as 'METHOD /path'."""
+
+    def dispatch(self):
+        name = '%s %s' % (self.request.method, self.request.path)
+        return measure(name, super(InstrumentedHandler, self).dispatch)
+
+
+def _percentile(histogram, calls, p):
+    """Return the upper bound (ms) of the histogram bucket holding the
+    p-th percentile; None for the open bucket."""
+    seen = 0
+    for bound in BUCKETS:
+        seen += histogram.get(str(bound), 0)
+        if seen * 100 >= calls * p:
+            return bound
+    return None
+
+
+def report(minutes=DEFAULT_WINDOW, name=None):
+    """Return {name: stats} summed over the last minutes, the current
+    minute included, for one call name or all that were called."""
+    minutes = max(1, min(MAX_WINDOW, minutes))
+    flush()
+    now = int(time.time() // 60)
+    window = range(now - minutes + 1, now + 1)
+    names = [name] if name else memcache.get(MEMCACHE_STATS_NAMES_KEY) or []
+
+    # calls first, so idle names cost no further reads
+    calls = memcache.get_multi([MEMCACHE_STATS_KEY % (m, n, 'calls')
+                                for n in names for m in window])
+    active = [n for n in names
+              if any(calls.get(MEMCACHE_STATS_KEY % (m, n, 'calls')) for m in window)]
+
+    metrics = (['errors', 'ms', 'bytesSent', 'bytesReceived'] +
+               RPC_METRICS + HISTOGRAM_METRICS)
+    values = memcache.get_multi([MEMCACHE_STATS_KEY % (m, n, metric)
+                                 for n in active for m in window
+                                 for metric in metrics])
+
+    result = {}
+    for n in active:
+        def total(metric, source=values):
+            return sum(int(source.get(MEMCACHE_STATS_KEY % (m, n, metric), 0))
+                       for m in window)
+        count = total('calls', calls)
+        histogram = dict((metric[3:], total(metric))
+                         for metric in HISTOGRAM_METRICS if total(metric))
+        rpcs = dict((metric, float(total(metric)) / count)
+                    for metric in RPC_METRICS if total(metric))
+        result[n] = {
+            'calls': count,
+            'errors': total('errors'),
+            'meanMs': float(total('ms')) / count,
+            'p50Ms': _percentile(histogram, count, 50),
+            'p95Ms': _percentile(histogram, count, 95),
+            'p99Ms': _percentile(histogram, count, 99),
+            'histogramMs': histogram,
+            'rpcsPerCall': rpcs,
+            'bytesSentPerCall': float(total('bytesSent')) / count,
+            'bytesReceivedPerCall': float(total('bytesReceived')) / count,
+        }
+    return result
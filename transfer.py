@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+"""transfer.py
+
+Udacity conference server-side Python App Engine newline-delimited JSON
+export & import of Conferences with their Sessions
+
+$Id$
+
+"""
+
+import json
+import time
+from datetime import datetime
+
+from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+import search
+from conference import ConferenceApi
+from conference import MEMCACHE_FEATURED_KEY
+from conference import MEMCACHE_SEATS_KEY
+from models import Conference
+from models import Session
+from models import SpeakerTally
+
+EXPORT_PAGE_SIZE = 100
+EXPORT_MAX_CONFERENCES = 100    # per response; continue with X-Next-Cursor
+IMPORT_BATCH_SIZE = 200
+IMPORT_TIME_BUDGET = 45         # seconds per request; continue with nextLine
+
+KINDS = {
+    'Conference': Conference,
+    'Session': Session,
+}
+
+
+class BadLineError(ValueError):
+    """A line that cannot be imported. line is its number; imported and
+    nextLine are as importEntities returns them, nextLine being the
+    start of the batch that was not stored."""
+
+    def __init__(self, message, line, imported, nextLine):
+        super(BadLineError, self).__init__(message)
+        self.line = line
+        self.imported = imported
+        self.nextLine = nextLine
+
+
+def entityToJson(entity):
+    """Return an entity as one line of JSON; the key is written as its
+    path so it can be imported under another app id."""
+    props = {}
+    for name, prop in entity._properties.items():
+        value = getattr(entity, name)
+        if isinstance(prop, ndb.DateProperty) and value:
+            value = value.isoformat()
+        props[name] = value
+    return json.dumps({'kind': entity._get_kind(),
+                       'key': list(entity.key.flat()),
+                       'properties': props})
+
+
+def entityFromJson(line):
+    """Return the entity of one line written by entityToJson."""
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("Not a JSON object: %r" % line[:100])
+    model = KINDS.get(record.get('kind'))
+    if not model:
+        raise ValueError("Unknown kind: %r" % record.get('kind'))
+    if not isinstance(record.get('key'), list) or \
+            not isinstance(record.get('properties'), dict):
+        raise ValueError("A %s line needs a 'key' list and a 'properties' "
+                         "object" % record['kind'])
+    props = {}
+    for name, value in record['properties'].items():
+        prop = model._properties.get(name)
+        if prop is None:
+            continue
+        if isinstance(prop, ndb.DateProperty) and value:
+            value = datetime.strptime(value, '%Y-%m-%d').date()
+        props[str(name)] = value
+    try:
+        return model(key=ndb.Key(flat=record['key']), **props)
+    except (TypeError, datastore_errors.Error) as e:
+        raise ValueError("Bad %s line: %s" % (record['kind'], e))
+
+
+def _writeConference(out, conf):
+    """Write a Conference and then its Sessions, page by page."""
+    out.write(entityToJson(conf) + '\n')
+    q = Session.query(ancestor=conf.key)
+    cursor, more = None, True
+    while more:
+        sessions, cursor, more = q.fetch_page(EXPORT_PAGE_SIZE, start_cursor=cursor)
+        for sess in sessions:
+            out.write(entityToJson(sess) + '\n')
+
+
+def exportConferences(out, websafeConferenceKey=None, cursor=None):
+    """Write one Conference, or all of them from cursor on, with their
+    Sessions to out as NDJSON. webapp2 buffers the whole response, so a
+    response holds at most EXPORT_MAX_CONFERENCES conferences.
+
+    Returns the urlsafe cursor to continue from, or None when done.
+    """
+    if websafeConferenceKey:
+        conf = ndb.Key(urlsafe=websafeConferenceKey).get()
+        if conf:
+            _writeConference(out, conf)
+        return None
+
+    start = Cursor(urlsafe=cursor) if cursor else None
+    written = 0
+    while written < EXPORT_MAX_CONFERENCES:
+        confs, start, more = Conference.query().fetch_page(
+            EXPORT_PAGE_SIZE, start_cursor=start)
+        for conf in confs:
+            _writeConference(out, conf)
+        written += len(confs)
+        if not more:
+            return None
+    return start.urlsafe()
+
+
+def _putBatch(entities):
+    """Store imported entities; their numeric ids are reserved first so
+    the id allocator never hands them out again."""
+    highest = {}
+    for entity in entities:
+        key = entity.key
+        if key.integer_id():
+            group = (type(entity), key.parent())
+            highest[group] = max(highest.get(group, 0), key.integer_id())
+    for (model, parent), max_id in highest.items():
+        model.allocate_ids(max=max_id, parent=parent)
+
+    # conferences replaced by the import leave the facets
+    confs = [e for e in entities if isinstance(e, Conference)]
+    old_confs = ndb.get_multi([conf.key for conf in confs])
+    old_seats = [ConferenceApi._seatsAvailableAsync(old) if old else None
+                 for old in old_confs]
+    old_seats = [f.get_result() if f else None for f in old_seats]
+
+    ndb.put_multi(entities + [search.documentFor(e) for e in entities])
+
+    # derived data of the touched conferences is rebuilt on next read
+    conf_keys = set(e.key if isinstance(e, Conference) else e.key.parent()
+                    for e in entities)
+    ndb.delete_multi([ndb.Key(SpeakerTally, 'speakers', parent=k)
+                      for k in conf_keys])
+    memcache.delete_multi([MEMCACHE_FEATURED_KEY % k.urlsafe() for k in conf_keys] +
+                          [MEMCACHE_SEATS_KEY % k.urlsafe() for k in conf_keys])
+    for k in conf_keys:
+        ConferenceApi._scheduleVersion(k, bump=True)
+        ConferenceApi._conferenceVersion(k, bump=True)
+
+    # count the imported conferences in the facets & nearly sold out set
+    changes = []
+    for conf, old, before in zip(confs, old_confs, old_seats):
+        seats = ConferenceApi._seatsAvailableAsync(conf).get_result()
+        if old:
+            changes.append((ConferenceApi._facetBuckets(old), -1, -before))
+        changes.append((ConferenceApi._facetBuckets(conf), 1, seats))
+        ConferenceApi._trackNearlySoldOut(conf.key, conf.name, seats)
+    if changes:
+        ConferenceApi._trackFacets(changes)
+
+
+def importEntities(lines, start=0):
+    """Import NDJSON lines written by exportConferences, skipping the
+    first start lines, in batches of IMPORT_BATCH_SIZE.
+
+    Stops after IMPORT_TIME_BUDGET seconds; returns (imported, nextLine)
+    where nextLine is the checkpoint to resume from, or None when done.
+    Raises BadLineError on a malformed line; the batches before it are
+    stored.
+    """
+    deadline = time.time() + IMPORT_TIME_BUDGET
+    imported = 0
+    batch = []
+    batch_start = start
+    for line_no, line in enumerate(lines):
+        if line_no < start or not line.strip():
+            continue
+        try:
+            batch.append(entityFromJson(line))
+        except ValueError as e:
+            raise BadLineError('Line %d: %s' % (line_no, e),
+                               line_no, imported, batch_start)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            _putBatch(batch)
+            imported += len(batch)
+            batch = []
+            batch_start = line_no + 1
+            if time.time() > deadline:
+                return imported, line_no + 1
+    if batch:
+        _putBatch(batch)
+        imported += len(batch)
+    return imported, None
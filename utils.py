@@ -1,10 +1,154 @@
+import hashlib
 import json
 import os
+import threading
 import time
 import uuid
+from collections import OrderedDict
 
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
+from google.appengine.ext import ndb
 from models import Profile
+from settings import TOKENINFO_URL
+
+TOKEN_CACHE_SIZE = 1000
+TOKEN_CACHE_MAX_TTL = 3600      # seconds; tokens are re-checked at least hourly
+TOKENINFO_ATTEMPTS = 3
+TOKENINFO_BACKOFF = 0.5         # seconds before the first retry, then doubled
+TOKENINFO_DEADLINE = 10
+MEMCACHE_TOKEN_KEY = "TOKENINFO:%s"
+
+
+class _TokenCache(object):
+    """Thread-safe LRU of token hash -> (user_id, expires_at)."""
+
+    def __init__(self, size):
+        self._size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[1] <= now:
+                return None
+            self._entries[key] = entry      # most recently used last
+            return entry[0]
+
+    def put(self, key, user_id, expires_at):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (user_id, expires_at)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+
+
+class _Fetch(object):
+    """A tokeninfo lookup in flight, shared by threads asking for the
+    same token."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.user_id = ''
+
+
+_tokens = _TokenCache(TOKEN_CACHE_SIZE)
+_fetches = {}
+_lock = threading.Lock()
+_stats = {'hits': 0, 'memcacheHits': 0, 'sharedFetches': 0, 'fetches': 0}
+
+
+def _count(stat):
+    with _lock:
+        _stats[stat] += 1
+
+
+def getTokenCacheStats():
+    """Return the tokeninfo cache counters and the overall hit rate."""
+    with _lock:
+        stats = dict(_stats)
+    lookups = sum(stats.values())
+    stats['hitRate'] = (float(lookups - stats['fetches']) / lookups
+                        if lookups else 0.0)
+    return stats
+
+
+@ndb.tasklet
+def _fetchTokenInfo(token):
+    """Return (via Future) the tokeninfo of token, retrying with backoff.
+
+    Uses async urlfetch and ndb.sleep; the caller's get_result() still
+    blocks its request thread until the lookup and its retries are done.
+    """
+    token_type = 'id_token'
+    if 'OAUTH_USER_ID' in os.environ:
+        token_type = 'access_token'
+    ctx = ndb.get_context()
+    wait = TOKENINFO_BACKOFF
+    for i in range(TOKENINFO_ATTEMPTS):
+        try:
+            resp = yield ctx.urlfetch('%s?%s=%s' % (TOKENINFO_URL, token_type, token),
+                                      deadline=TOKENINFO_DEADLINE)
+        except urlfetch.Error:
+            resp = None
+        if resp and resp.status_code == 200:
+            raise ndb.Return(json.loads(resp.content))
+        elif resp and resp.status_code == 400 and 'invalid_token' in resp.content:
+            token_type = 'access_token'
+        elif i < TOKENINFO_ATTEMPTS - 1:
+            yield ndb.sleep(wait)
+            wait *= 2
+    raise ndb.Return({})
+
+
+def _getOauthUserId(token):
+    """Return the user_id of an OAuth token.
+
+    Looks in the in-process LRU, then memcache, then asks the tokeninfo
+    service; entries live until the token expires. Threads asking for
+    the same token at the same time share a single fetch.
+    """
+    key = hashlib.sha256(token).hexdigest()
+    now = time.time()
+    user_id = _tokens.get(key, now)
+    if user_id is not None:
+        _count('hits')
+        return user_id
+
+    cached = memcache.get(MEMCACHE_TOKEN_KEY % key)
+    if cached and cached[1] > now:
+        _count('memcacheHits')
+        _tokens.put(key, *cached)
+        return cached[0]
+
+    with _lock:
+        fetch = _fetches.get(key)
+        leader = fetch is None
+        if leader:
+            fetch = _fetches[key] = _Fetch()
+    if not leader:
+        _count('sharedFetches')
+        fetch.done.wait(TOKENINFO_DEADLINE * TOKENINFO_ATTEMPTS)
+        return fetch.user_id
+
+    _count('fetches')
+    try:
+        info = _fetchTokenInfo(token).get_result()
+        fetch.user_id = info.get('user_id', '')
+        if fetch.user_id:
+            ttl = min(int(info.get('expires_in', TOKEN_CACHE_MAX_TTL)),
+                      TOKEN_CACHE_MAX_TTL)
+            if ttl > 0:
+                _tokens.put(key, fetch.user_id, now + ttl)
+                memcache.set(MEMCACHE_TOKEN_KEY % key,
+                             (fetch.user_id, now + ttl), time=ttl)
+    finally:
+        with _lock:
+            del _fetches[key]
+        fetch.done.set()
+    return fetch.user_id
+
 
 def getUserId(user, id_type="email"):
     if id_type == "email":
@@ -14,25 +158,7 @@ def getUserId(user, id_type="email"):
         """A workaround implementation for getting userid."""
         auth = os.getenv('HTTP_AUTHORIZATION')
         bearer, token = auth.split()
-        token_type = 'id_token'
-        if 'OAUTH_USER_ID' in os.environ:
-            token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        return _getOauthUserId(token)
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm